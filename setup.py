@@ -49,7 +49,7 @@ classifiers = [
     "Programming Language :: Python :: Implementation :: PyPy",
 ]
 
-INSTALL_REQURIES = ["setuptools", "iiblib", "pushcollector", "requests"]
+INSTALL_REQURIES = ["iiblib", "kerberos", "pushcollector", "requests"]
 
 DEPENDENCY_LINKS = []
 
@@ -82,6 +82,7 @@ setup(
             "pubtools-iib-add-bundles = pubtools.iib.iib_ops:add_bundles_main",
             "pubtools-iib-remove-operators = pubtools.iib.iib_ops:remove_operators_main",
             "pubtools-iib-add-deprecations = pubtools.iib.iib_ops:add_deprecations_main",
+            "pubtools-iib-worker = pubtools.iib.worker:worker_main",
         ]
     },
     include_package_data=True,
@@ -1 +1,19 @@
 """pubtools_iib."""
+
+from .api import IIBOperations
+from .engine import IIBOperation, IIBOperationResult
+from .errors import CircuitOpenError, IIBBuildFailed, IIBOperationError
+from .retry import CircuitBreaker, RetryPolicy
+from .scheduler import IndexScheduler
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "IIBBuildFailed",
+    "IIBOperation",
+    "IIBOperationError",
+    "IIBOperationResult",
+    "IIBOperations",
+    "IndexScheduler",
+    "RetryPolicy",
+]
@@ -0,0 +1,493 @@
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+from .engine import IIBOperation, IIBOperationEngine, IIBOperationResult
+from .errors import IIBBuildFailed, IIBOperationError
+from .poller import TERMINAL_STATES, AdaptiveBackoff, BuildPoller
+
+if TYPE_CHECKING:
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+    from iiblib.iib_client import IIBClient
+
+    from .deadline import Deadline
+    from .journal import BuildJournal
+    from .retry import RetryPolicy
+
+LOG = logging.getLogger("pubtools.iib")
+
+
+class IIBOperations:
+    """
+    Library API for running IIB operations.
+
+    All dependencies are passed explicitly and nothing process-global is
+    touched: no logging configuration, no signal handlers and no
+    ``sys.exit``. Every call builds its own engine and poller, so a single
+    instance can be used from many threads at once. The client and collector
+    must be thread-safe themselves, which holds for clients created by
+    ``setup_iib_client`` and for pushcollector.
+
+    Operations can also be started without blocking by :meth:`submit` and
+    the ``*_async`` methods, which return futures. Builds started this way
+    are all waited on by a single polling thread.
+
+    Example::
+
+        ops = IIBOperations(iib_client, collector)
+        result = ops.add_bundles("registry/index:v4.16", bundles=["bundle:1"])
+        print(result.build_details.index_image)
+
+        future = ops.add_bundles_async("registry/index:v4.17", bundles=["bundle:1"])
+        future.add_done_callback(sign_index)
+
+    Args:
+        iib_client (IIBClient): Client used to talk to IIB.
+        collector (pushcollector.Collector): Collector receiving push items.
+        backoff (AdaptiveBackoff): Strategy of polling builds. Defaults to
+            :class:`AdaptiveBackoff` with its default intervals.
+        build_timeout (float): Seconds to wait for a single build.
+        on_update (callable): Invoked with fresh details of every watched
+            build after each polling round.
+        on_complete (callable): Invoked with :class:`IIBOperationResult` of
+            each finished operation.
+        journal (BuildJournal): Optional journal of submitted builds.
+        resume (bool): Attach to unfinished builds found in ``journal``.
+        cache_ttl (float): Reuse successful builds of identical requests
+            recorded in ``journal`` in the last ``cache_ttl`` seconds.
+        verify_cache (bool): Confirm cached builds with IIB before reusing them.
+        coalesce (bool): Merge add_bundles operations for the same index.
+        chunk_size (int): Send push items to the collector in chunks.
+        submit_workers (int): Threads submitting and finishing operations
+            started by :meth:`submit`.
+        retry_policy (RetryPolicy): Optional policy retrying requests and
+            builds which failed for transient reasons.
+        batch_size (int): Submit add and rm operations of :meth:`run` in
+            batches of this many operations, see :class:`IIBOperationEngine`.
+    """
+
+    def __init__(
+        self,
+        iib_client: IIBClient,
+        collector: Any,
+        backoff: AdaptiveBackoff | None = None,
+        build_timeout: float = 7200,
+        on_update: Callable[[IIBBuildDetailsModel], None] | None = None,
+        on_complete: Callable[[IIBOperationResult], None] | None = None,
+        journal: BuildJournal | None = None,
+        resume: bool = False,
+        cache_ttl: float = 0,
+        verify_cache: bool = False,
+        coalesce: bool = False,
+        chunk_size: int = 0,
+        submit_workers: int = 4,
+        retry_policy: RetryPolicy | None = None,
+        batch_size: int = 0,
+    ) -> None:
+        self.iib_client = iib_client
+        self.collector = collector
+        self.backoff = backoff or AdaptiveBackoff()
+        self.build_timeout = build_timeout
+        self.on_update = on_update
+        self.on_complete = on_complete
+        self.journal = journal
+        self.resume = resume
+        self.cache_ttl = cache_ttl
+        self.verify_cache = verify_cache
+        self.coalesce = coalesce
+        self.chunk_size = chunk_size
+        self.submit_workers = submit_workers
+        self.retry_policy = retry_policy
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._async_engine: IIBOperationEngine | None = None
+        # poller -> event waking up the thread polling it
+        self._polling: dict[BuildPoller, threading.Event] = {}
+
+    def make_engine(
+        self, deadline: Deadline | None = None, poller: BuildPoller | None = None
+    ) -> IIBOperationEngine:
+        """Return engine executing operations of a single run."""
+        poller = poller or BuildPoller(
+            self.iib_client,
+            timeout=self.build_timeout,
+            backoff=self.backoff,
+            on_update=self.on_update,
+            deadline=deadline,
+            retry_policy=self.retry_policy,
+        )
+        return IIBOperationEngine(
+            self.iib_client,
+            self.collector,
+            on_complete=self.on_complete,
+            poller=poller,
+            coalesce=self.coalesce,
+            journal=self.journal,
+            resume=self.resume,
+            cache_ttl=self.cache_ttl,
+            verify_cache=self.verify_cache,
+            deadline=deadline,
+            chunk_size=self.chunk_size,
+            retry_policy=self.retry_policy,
+            batch_size=self.batch_size,
+        )
+
+    def run(
+        self,
+        operations: Iterable[IIBOperation],
+        deadline: Deadline | None = None,
+        check: bool = True,
+    ) -> list[IIBOperationResult]:
+        """
+        Execute operations and wait for all of their builds.
+
+        Args:
+            operations (list): Operations to execute.
+            deadline (Deadline): Optional budget of the whole run.
+            check (bool): Raise :class:`IIBBuildFailed` when a build failed.
+
+        Returns:
+            list: :class:`IIBOperationResult` of each operation, in order.
+
+        Raises:
+            IIBBuildFailed: When ``check`` is set and a build failed.
+            IIBOperationError: When IIB could not carry out the operations,
+                e.g. a build was not finished in time or IIB was unreachable.
+        """
+        try:
+            results = self.make_engine(deadline).run(operations)
+        except _iib_errors() as e:
+            raise IIBOperationError(str(e)) from e
+        if check and any(result.failed for result in results):
+            raise IIBBuildFailed(results)
+        return results
+
+    def _run_one(
+        self,
+        operation: str,
+        index_image: str | None,
+        items_final_state: str,
+        op_args: dict[str, Any],
+    ) -> IIBOperationResult:
+        return self.run(
+            [_make_operation(operation, index_image, items_final_state, op_args)]
+        )[0]
+
+    def add_bundles(
+        self,
+        index_image: str | None,
+        bundles: list[str] | None = None,
+        items_final_state: str = "PUSHED",
+        **op_args: Any,
+    ) -> IIBOperationResult:
+        """
+        Add bundles to an index image.
+
+        Args:
+            index_image (str): Index image to rebuild, None for a new index.
+            bundles (list): Bundle images to add.
+            items_final_state (str): State of push items when the build succeeds.
+            op_args: Other arguments of ``IIBClient.add_bundles``, e.g.
+                ``arches``, ``binary_image`` or ``overwrite_from_index``.
+
+        Returns:
+            IIBOperationResult: Finished operation.
+
+        Raises:
+            IIBBuildFailed: When the IIB build failed.
+            IIBOperationError: When IIB could not carry out the operation.
+        """
+        return self._run_one(
+            "add_bundles",
+            index_image,
+            items_final_state,
+            dict(op_args, bundles=bundles),
+        )
+
+    def remove_operators(
+        self,
+        index_image: str,
+        operators: list[str],
+        items_final_state: str = "DELETED",
+        **op_args: Any,
+    ) -> IIBOperationResult:
+        """
+        Remove operators from an index image.
+
+        Arguments and errors are the same as of :meth:`add_bundles`.
+        """
+        return self._run_one(
+            "remove_operators",
+            index_image,
+            items_final_state,
+            dict(op_args, operators=operators),
+        )
+
+    def add_deprecations(
+        self,
+        index_image: str,
+        operator_package: str,
+        deprecation_schema: str,
+        items_final_state: str = "PUSHED",
+        **op_args: Any,
+    ) -> IIBOperationResult:
+        """
+        Add deprecations of an operator package to an index image.
+
+        Arguments and errors are the same as of :meth:`add_bundles`.
+        """
+        return self._run_one(
+            "add_deprecations",
+            index_image,
+            items_final_state,
+            dict(
+                op_args,
+                operator_package=operator_package,
+                deprecation_schema=deprecation_schema,
+            ),
+        )
+
+    def submit(
+        self, operation: IIBOperation, check: bool = True
+    ) -> "Future[IIBOperationResult]":
+        """
+        Start operation and return future resolved once its build finishes.
+
+        The future resolves to :class:`IIBOperationResult`, or fails with the
+        same exceptions :meth:`run` raises. Cancelling the future before the
+        build finishes cancels the build in IIB and marks its push items
+        NOTPUSHED.
+
+        Args:
+            operation (IIBOperation): Operation to start.
+            check (bool): Fail the future with :class:`IIBBuildFailed` when
+                the build failed.
+        """
+        executor, engine = self._async_state()
+        future: "Future[IIBOperationResult]" = Future()
+        submitted: list[IIBBuildDetailsModel] = []
+        resubmits = [0]
+        cancel_lock = threading.Lock()
+
+        def cancel_build() -> None:
+            # called by both the caller cancelling and the submitting thread
+            with cancel_lock:
+                if submitted:
+                    engine.cancel(operation, submitted.pop())
+
+        def on_cancel(f: "Future[IIBOperationResult]") -> None:
+            if f.cancelled():
+                submit_future.cancel()
+                cancel_build()
+
+        def finish(build_details: IIBBuildDetailsModel, cached: bool = False) -> None:
+            if engine.should_resubmit(build_details, resubmits[0]):
+                resubmits[0] += 1
+                watch(engine.resubmit(operation, build_details))
+                return
+            with cancel_lock:
+                if future.cancelled():
+                    return
+                # finished build must not be canceled anymore
+                submitted.clear()
+            result = engine.finish(operation, build_details, cached)
+            if check and result.failed:
+                _set_exception(future, IIBBuildFailed([result]))
+            else:
+                _set_result(future, result)
+
+        def on_build_done(f: "Future[IIBBuildDetailsModel]") -> None:
+            if f.cancelled() or future.cancelled():
+                return
+            exc = f.exception()
+            if exc:
+                # timed out, do not leave the build running in IIB
+                cancel_build()
+                _set_exception(future, _wrap_exception(exc))
+                return
+            executor.submit(_call_or_fail, future, finish, f.result())
+
+        def start() -> None:
+            cached = engine.cached_build(operation)
+            if cached:
+                finish(cached, cached=True)
+                return
+            build_details = engine.submit(operation)
+            if build_details.state in TERMINAL_STATES:
+                # attached to a build which already finished
+                with cancel_lock:
+                    submitted[:] = [build_details]
+                finish(build_details)
+                return
+            watch(build_details)
+
+        def watch(build_details: IIBBuildDetailsModel) -> None:
+            with cancel_lock:
+                submitted[:] = [build_details]
+            if future.cancelled():
+                cancel_build()
+                return
+            engine.poller.watch(build_details).add_done_callback(on_build_done)
+            self._ensure_polling(engine.poller)
+
+        submit_future = executor.submit(_call_or_fail, future, start)
+        future.add_done_callback(on_cancel)
+        return future
+
+    def add_bundles_async(
+        self,
+        index_image: str | None,
+        bundles: list[str] | None = None,
+        items_final_state: str = "PUSHED",
+        **op_args: Any,
+    ) -> "Future[IIBOperationResult]":
+        """Non-blocking :meth:`add_bundles`, returns future of the result."""
+        return self.submit(
+            _make_operation(
+                "add_bundles",
+                index_image,
+                items_final_state,
+                dict(op_args, bundles=bundles),
+            )
+        )
+
+    def remove_operators_async(
+        self,
+        index_image: str,
+        operators: list[str],
+        items_final_state: str = "DELETED",
+        **op_args: Any,
+    ) -> "Future[IIBOperationResult]":
+        """Non-blocking :meth:`remove_operators`, returns future of the result."""
+        return self.submit(
+            _make_operation(
+                "remove_operators",
+                index_image,
+                items_final_state,
+                dict(op_args, operators=operators),
+            )
+        )
+
+    def add_deprecations_async(
+        self,
+        index_image: str,
+        operator_package: str,
+        deprecation_schema: str,
+        items_final_state: str = "PUSHED",
+        **op_args: Any,
+    ) -> "Future[IIBOperationResult]":
+        """Non-blocking :meth:`add_deprecations`, returns future of the result."""
+        return self.submit(
+            _make_operation(
+                "add_deprecations",
+                index_image,
+                items_final_state,
+                dict(
+                    op_args,
+                    operator_package=operator_package,
+                    deprecation_schema=deprecation_schema,
+                ),
+            )
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Release threads used by :meth:`submit`."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._async_engine = None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _async_state(self) -> tuple[ThreadPoolExecutor, IIBOperationEngine]:
+        with self._lock:
+            if self._executor is None or self._async_engine is None:
+                self._executor = ThreadPoolExecutor(
+                    self.submit_workers, thread_name_prefix="pubtools-iib"
+                )
+                self._async_engine = self.make_engine()
+            return self._executor, self._async_engine
+
+    def _ensure_polling(self, poller: BuildPoller) -> None:
+        with self._lock:
+            wakeup = self._polling.get(poller)
+            if wakeup is None:
+                # a new engine after shutdown() gets its own polling thread
+                wakeup = self._polling[poller] = threading.Event()
+                threading.Thread(
+                    target=self._poll_loop,
+                    args=(poller, wakeup),
+                    name="pubtools-iib-poller",
+                    daemon=True,
+                ).start()
+            else:
+                wakeup.set()
+
+    def _poll_loop(self, poller: BuildPoller, wakeup: threading.Event) -> None:
+        from iiblib.iib_client import IIBException
+
+        while True:
+            with self._lock:
+                if not poller.pending:
+                    del self._polling[poller]
+                    return
+            try:
+                poller.poll()
+            except IIBException:
+                # timed out builds carry the error in their futures
+                pass
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to poll IIB builds: %s", e)
+            wakeup.wait(poller.next_interval())
+            wakeup.clear()
+
+
+def _make_operation(
+    operation: str,
+    index_image: str | None,
+    items_final_state: str,
+    op_args: dict[str, Any],
+) -> IIBOperation:
+    op_args = {key: value for key, value in op_args.items() if value is not None}
+    return IIBOperation(operation, index_image, op_args, items_final_state)
+
+
+def _iib_errors() -> tuple[type[Exception], ...]:
+    """Return errors of IIB and of requests to it, raised as IIBOperationError."""
+    import requests
+    from iiblib.iib_client import IIBException
+
+    return (IIBException, requests.RequestException)
+
+
+def _wrap_exception(exc: BaseException) -> BaseException:
+    if isinstance(exc, _iib_errors()):
+        wrapped = IIBOperationError(str(exc))
+        wrapped.__cause__ = exc
+        return wrapped
+    return exc
+
+
+def _set_result(future: "Future[Any]", result: Any) -> None:
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        # cancelled by the caller in the meantime
+        pass
+
+
+def _set_exception(future: "Future[Any]", exc: BaseException) -> None:
+    try:
+        future.set_exception(exc)
+    except InvalidStateError:
+        pass
+
+
+def _call_or_fail(future: "Future[Any]", func: Callable[..., None], *args: Any) -> None:
+    try:
+        func(*args)
+    except Exception as e:  # pylint: disable=broad-except
+        _set_exception(future, _wrap_exception(e))
@@ -0,0 +1,226 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import subprocess  # nosec B404
+import threading
+import time
+from typing import Any
+
+import kerberos
+from iiblib.iib_authentication import IIBKrbAuth
+
+LOG = logging.getLogger("pubtools.iib")
+
+# KRB5CCNAME is process-wide, serialize everything which switches it
+_ENV_LOCK = threading.RLock()
+
+# formats of ticket times printed by MIT and Heimdal klist in the C locale
+KLIST_TIME_FORMATS = ("%m/%d/%y %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%b %d %H:%M:%S %Y")
+
+
+def default_ccache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "pubtools-iib")
+
+
+def ticket_end_time(klist_output: str) -> float | None:
+    """
+    Return end time of the ticket granting ticket listed by klist.
+
+    Returns:
+        float: Expiry as a timestamp, None when klist output lists no ticket
+            granting ticket or its time cannot be parsed.
+    """
+    for line in klist_output.splitlines():
+        # columns are separated by two spaces, times contain single ones
+        fields = re.split(r"\s{2,}", line.strip())
+        if len(fields) < 3 or not fields[-1].startswith("krbtgt/"):
+            continue
+        for fmt in KLIST_TIME_FORMATS:
+            try:
+                return time.mktime(time.strptime(fields[1], fmt))
+            except ValueError:
+                continue
+    return None
+
+
+class CachedKrbAuth(IIBKrbAuth):  # type: ignore[misc]
+    """
+    Kerberos authentication reusing tickets across operations and invocations.
+
+    Tickets obtained from a keytab are stored in a private credential cache
+    keyed by principal and keytab, and reused until they get close to expiry.
+    Instances returned by :meth:`get` are shared by all clients in the process,
+    so the SPNEGO negotiation also happens only once per ticket.
+
+    Args:
+        krb_princ (str): Kerberos principal for obtaining ticket.
+        service (str): Hostname of IIB service.
+        ktfile (str): Kerberos client keytab file.
+        ccache_dir (str): Directory holding private credential caches.
+    """
+
+    # requested lifetime of tickets obtained by kinit, KDC may grant less
+    ticket_lifetime = 8 * 3600
+    # tickets closer than this to expiry are renewed
+    renew_margin = 600
+
+    _instances: dict[tuple[Any, ...], "CachedKrbAuth"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        krb_princ: str,
+        service: str,
+        ktfile: str | None = None,
+        ccache_dir: str | None = None,
+    ) -> None:
+        super().__init__(krb_princ, service, ktfile=ktfile)
+        self.ccache_dir = ccache_dir or default_ccache_dir()
+        key = "%s:%s" % (krb_princ, os.path.abspath(ktfile) if ktfile else "")
+        self.ccache = os.path.join(
+            self.ccache_dir,
+            "krb5cc_%s" % hashlib.sha256(key.encode("utf-8")).hexdigest()[:16],
+        )
+        self._lock = threading.Lock()
+        self._auth_header: str | None = None
+        self._auth_header_expires = 0.0
+
+    @classmethod
+    def get(
+        cls,
+        krb_princ: str,
+        service: str,
+        ktfile: str | None = None,
+        ccache_dir: str | None = None,
+    ) -> "CachedKrbAuth":
+        """Return instance shared by all callers with the same arguments."""
+        key = (krb_princ, service, ktfile, ccache_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(
+                    krb_princ, service, ktfile=ktfile, ccache_dir=ccache_dir
+                )
+            return cls._instances[key]
+
+    @staticmethod
+    def _klist(ccache: str | None = None) -> bool:
+        cmd = ["klist", "-s"]
+        if ccache:
+            cmd.extend(["-c", ccache])
+        return (
+            subprocess.run(  # nosec B603 B607
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            ).returncode
+            == 0
+        )
+
+    @staticmethod
+    def _ticket_end(ccache: str | None = None) -> float | None:
+        """Return end time of the ticket in ccache, 0 if there is none."""
+        cmd = ["klist"]
+        if ccache:
+            cmd.extend(["-c", ccache])
+        proc = subprocess.run(  # nosec B603 B607
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(os.environ, LC_ALL="C"),
+        )
+        if proc.returncode:
+            return 0
+        return ticket_end_time(proc.stdout.decode("utf-8", errors="replace"))
+
+    def _ticket_expires(self, ccache: str | None = None) -> float:
+        """Return time when the ticket in ccache is due for renewal."""
+        end = self._ticket_end(ccache)
+        if end is None:
+            # unknown klist output, trust a valid ticket for a while
+            return time.time() + self.renew_margin if self._klist(ccache) else 0
+        return end - self.renew_margin
+
+    def _ccache_expires(self) -> float:
+        if not os.path.exists(self.ccache):
+            return 0
+        return self._ticket_expires(self.ccache)
+
+    def _kinit(self) -> None:
+        cmd = ["kinit", self.krb_princ, "-k", "-l", "%ds" % self.ticket_lifetime]
+        if self.ktfile:
+            cmd.extend(["-t", self.ktfile])
+        cmd.extend(["-c", self.ccache])
+        LOG.debug("Obtaining kerberos ticket for %s", self.krb_princ)
+        proc = subprocess.run(  # nosec B603 B607
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if proc.returncode:
+            LOG.warning(
+                "kinit for %s failed: %s",
+                self.krb_princ,
+                proc.stderr.decode("utf-8", errors="replace").strip(),
+            )
+            return
+        os.chmod(self.ccache, 0o600)
+
+    def _ensure_ccache(self) -> float:
+        """Make sure the private ccache holds valid ticket, return its expiry."""
+        expires = self._ccache_expires()
+        if expires > time.time():
+            return expires
+        os.makedirs(self.ccache_dir, mode=0o700, exist_ok=True)
+        # lock against other processes sharing the same ccache
+        with open(self.ccache + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                expires = self._ccache_expires()
+                if expires <= time.time():
+                    self._kinit()
+                    expires = self._ccache_expires()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return expires
+
+    def _negotiate(self, ccache: str | None) -> str:
+        with _ENV_LOCK:
+            old_krb5ccname = os.environ.get("KRB5CCNAME")
+            try:
+                if ccache:
+                    os.environ["KRB5CCNAME"] = ccache
+                __, krb_context = kerberos.authGSSClientInit("HTTP@%s" % self.service)
+                kerberos.authGSSClientStep(krb_context, "")
+                return "Negotiate " + str(kerberos.authGSSClientResponse(krb_context))
+            finally:
+                if old_krb5ccname is None:
+                    os.environ.pop("KRB5CCNAME", None)
+                else:
+                    os.environ["KRB5CCNAME"] = old_krb5ccname
+
+    def _krb_auth_header(self) -> str:
+        with self._lock:
+            if self._auth_header and self._auth_header_expires > time.time():
+                return self._auth_header
+
+            expires = 0.0
+            if not self.ktfile:
+                # user may already have a valid ticket in the default ccache
+                expires = self._ticket_expires()
+            if expires > time.time():
+                ccache = None
+            else:
+                ccache = self.ccache
+                expires = self._ensure_ccache()
+
+            try:
+                self._auth_header = self._negotiate(ccache)
+            except kerberos.KrbError:
+                if not ccache:
+                    raise
+                # ccache may be corrupted or revoked, get a fresh ticket once
+                LOG.debug("Kerberos negotiation failed, renewing ticket")
+                self._kinit()
+                expires = self._ccache_expires()
+                self._auth_header = self._negotiate(ccache)
+            self._auth_header_expires = expires
+            return self._auth_header
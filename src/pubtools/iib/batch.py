@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any, Iterable
+
+if TYPE_CHECKING:
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+    from iiblib.iib_client import IIBClient
+
+    from .engine import IIBOperation
+
+LOG = logging.getLogger("pubtools.iib")
+
+# operations accepted by the add-rm-batch endpoint
+BATCH_OPERATIONS = ("add_bundles", "remove_operators")
+
+# op_args which IIB knows under a different name
+_RENAMED_ARGS = {"arches": "add_arches"}
+
+
+def batch_request_data(operation: IIBOperation) -> dict[str, Any]:
+    """
+    Return build request of an operation as expected by IIB add-rm-batch endpoint.
+
+    The request is the same as the one IIBClient sends to ``builds/add`` or
+    ``builds/rm``.
+
+    Raises:
+        ValueError: When the operation cannot be submitted in a batch, or
+            when only one of overwrite_from_index and its token is set.
+    """
+    if operation.operation not in BATCH_OPERATIONS:
+        raise ValueError(
+            "Operation %s cannot be submitted in a batch" % operation.operation
+        )
+    op_args = dict(operation.op_args)
+    if bool(op_args.get("overwrite_from_index")) != bool(
+        op_args.get("overwrite_from_index_token")
+    ):
+        raise ValueError(
+            "Either both or neither of overwrite-from-index and "
+            "overwrite-from-index-token should be specified."
+        )
+
+    data: dict[str, Any] = {"from_index": operation.index_image}
+    if operation.operation == "add_bundles":
+        data["deprecation_list"] = []
+    else:
+        # IIB tells add and rm requests apart by presence of operators
+        data["operators"] = op_args.pop("operators", None) or []
+    data["add_arches"] = op_args.pop("arches", None)
+    for key, value in op_args.items():
+        if value:
+            data[_RENAMED_ARGS.get(key, key)] = value
+    return data
+
+
+def submit_batch(
+    iib_client: IIBClient,
+    operations: Iterable[IIBOperation],
+    annotations: dict[str, Any] | None = None,
+) -> list[IIBBuildDetailsModel]:
+    """
+    Submit add and rm operations to IIB in a single batch.
+
+    IIB assigns all builds the same ``batch`` number and processes them in
+    the order of ``operations``.
+
+    Args:
+        iib_client (IIBClient): Client whose session is used for the request.
+        operations (list): Operations from :data:`BATCH_OPERATIONS`.
+        annotations (dict): Optional annotations of the batch.
+
+    Returns:
+        list: Details of the submitted builds in the order of ``operations``.
+    """
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+    post_data: dict[str, Any] = {
+        "build_requests": [batch_request_data(operation) for operation in operations]
+    }
+    if annotations:
+        post_data["annotations"] = annotations
+    LOG.debug("Submitting %d requests in one batch", len(post_data["build_requests"]))
+    resp = iib_client.iib_session.post("builds/add-rm-batch", json=post_data)
+    iib_client._check_response(resp)
+    return [IIBBuildDetailsModel.from_dict(item) for item in resp.json()]
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import logging
+import threading
+from itertools import islice
+from types import TracebackType
+from typing import Any
+
+LOG = logging.getLogger("pubtools.iib")
+
+
+def _item_key(item: dict[Any, Any]) -> tuple[Any, ...]:
+    return (item.get("origin"), item.get("src"), item.get("filename"))
+
+
+class BufferedCollector:
+    """
+    Push item sink sending updates to a collector from a background thread.
+
+    Updates are queued and sent in batches of up to ``batch_size`` items, so
+    operations do not wait for the collector backend. Updates of the same
+    push item which were not sent yet are coalesced, e.g. a PENDING item
+    superseded by PUSHED within ``flush_interval`` is sent only once in its
+    final state.
+
+    :meth:`close` sends everything which is queued and must be called before
+    the process exits, the instance can be used as a context manager for
+    that.
+
+    Args:
+        collector (pushcollector.Collector): Collector receiving the updates.
+        batch_size (int): Maximal number of push items sent in one update.
+        flush_interval (float): Seconds to collect updates before sending them.
+    """
+
+    def __init__(
+        self, collector: Any, batch_size: int = 500, flush_interval: float = 1
+    ) -> None:
+        self.collector = collector
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: dict[tuple[Any, ...], dict[Any, Any]] = {}
+        self._cond = threading.Condition()
+        self._sending = 0
+        self._flushing = 0
+        self._closed = False
+        self._error: Exception | None = None
+        self._thread = threading.Thread(
+            target=self._run, name="pubtools-iib-collector", daemon=True
+        )
+        self._thread.start()
+
+    def update_push_items(self, items: list[dict[Any, Any]]) -> None:
+        """Queue push items to be sent to the collector."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Collector is closed")
+            for item in items:
+                key = _item_key(item)
+                # keep position of the first update, send the latest state
+                self._pending[key] = item
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _take_batch(self) -> list[dict[Any, Any]] | None:
+        with self._cond:
+            self._cond.wait_for(lambda: bool(self._pending) or self._closed)
+            if (
+                not self._closed
+                and not self._flushing
+                and len(self._pending) < self.batch_size
+            ):
+                # give successive state changes a chance to be coalesced
+                self._cond.wait(self.flush_interval)
+            if not self._pending:
+                return None
+            keys = list(islice(self._pending, self.batch_size))
+            self._sending += 1
+            return [self._pending.pop(key) for key in keys]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                with self._cond:
+                    if self._closed and not self._pending:
+                        return
+                continue
+            try:
+                ret = self.collector.update_push_items(batch)
+                if hasattr(ret, "result"):
+                    # pushcollector returns a future
+                    ret.result()
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Unable to update %d push items: %s", len(batch), e)
+                with self._cond:
+                    self._error = self._error or e
+            finally:
+                with self._cond:
+                    self._sending -= 1
+                    self._cond.notify_all()
+
+    def flush(self) -> None:
+        """
+        Wait until all queued push items are sent.
+
+        Raises:
+            Exception: First error raised by the collector since the last flush.
+        """
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                self._cond.wait_for(
+                    lambda: not (self._pending or self._sending)
+                    or not self._thread.is_alive()
+                )
+            finally:
+                self._flushing -= 1
+            error, self._error = self._error, None
+        if error:
+            raise error
+
+    def close(self) -> None:
+        """Send all queued push items and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def __enter__(self) -> BufferedCollector:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
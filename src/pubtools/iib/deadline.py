@@ -0,0 +1,58 @@
+import re
+import time
+from datetime import datetime
+
+_RELATIVE_RE = re.compile(
+    r"^\+?(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m)?(?:(\d+(?:\.\d+)?)s?)?$"
+)
+
+
+class Deadline:
+    """
+    Wall-clock budget shared by all phases of a run.
+
+    The deadline is tracked on the monotonic clock, so it is not affected by
+    changes of the system time once parsed.
+
+    Args:
+        expires (float): Value of :func:`time.monotonic` when the budget runs out.
+    """
+
+    def __init__(self, expires: float) -> None:
+        self.expires = expires
+
+    @classmethod
+    def parse(cls, value: str) -> "Deadline":
+        """
+        Create deadline from a relative or absolute value.
+
+        Relative values are seconds from now with optional ``h``, ``m`` and
+        ``s`` units, e.g. ``3600``, ``+90m`` or ``1h30m``. Absolute values are
+        ISO 8601 timestamps, e.g. ``2024-09-01T18:00:00+00:00``. Timestamps
+        without a timezone are in local time.
+
+        Raises:
+            ValueError: When the value is in neither format.
+        """
+        match = _RELATIVE_RE.match(value.strip())
+        if match and any(match.groups()):
+            hours, minutes, seconds = (float(x or 0) for x in match.groups())
+            return cls.after(hours * 3600 + minutes * 60 + seconds)
+        try:
+            absolute = datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise ValueError("Invalid deadline: %s" % value) from None
+        return cls.after(absolute.timestamp() - time.time())
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        """Create deadline expiring ``seconds`` from now."""
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        """Return seconds left until the deadline, never negative."""
+        return max(self.expires - time.monotonic(), 0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
@@ -0,0 +1,562 @@
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator
+
+from .batch import BATCH_OPERATIONS, submit_batch
+from .deadline import Deadline
+from .journal import BuildJournal, request_fingerprint
+from .poller import TERMINAL_STATES, BuildPoller, iter_builds
+from .push_items import iter_compact_push_items, iter_push_items, send_push_items
+
+if TYPE_CHECKING:
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+    from iiblib.iib_client import IIBClient
+
+    from .retry import RetryPolicy
+
+LOG = logging.getLogger("pubtools.iib")
+
+OPERATIONS = ("add_bundles", "remove_operators", "add_deprecations")
+
+# arguments of add_bundles which are merged when operations are coalesced
+COALESCED_ARGS = ("bundles", "deprecation_list")
+
+
+@dataclass
+class IIBOperation:
+    """
+    Single IIB operation to be executed by :class:`IIBOperationEngine`.
+
+    Args:
+        operation (str): Name of IIBClient method (one of ``OPERATIONS``).
+        index_image (str): Index image to rebuild, None to build from scratch.
+        op_args (dict): Keyword arguments passed to the IIBClient method.
+        items_final_state (str): State of push items when the build succeeds.
+        build_id (int): ID of an already submitted build to attach to instead
+            of submitting the operation again.
+    """
+
+    operation: str
+    index_image: str | None
+    op_args: dict[str, Any] = field(default_factory=dict)
+    items_final_state: str = "PUSHED"
+    build_id: Any = None
+
+    def __post_init__(self) -> None:
+        if self.operation not in OPERATIONS:
+            raise ValueError("Unsupported iib operation: %s" % self.operation)
+
+
+@dataclass
+class IIBOperationResult:
+    """
+    Finished IIB operation together with its final build details.
+
+    Push items are produced from ``build_details`` on access, so results of
+    large builds do not keep them in memory.
+
+    Args:
+        operation (IIBOperation): The finished operation.
+        build_details (IIBBuildDetailsModel): Final details of its build.
+        items_state (str): Final state of the push items.
+        bundles (list): Bundles of the operation when its build was shared
+            with other operations, None for all push items of the build.
+    """
+
+    operation: IIBOperation
+    build_details: IIBBuildDetailsModel
+    items_state: str
+    bundles: list[str] | None = None
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.build_details.state == "failed")
+
+    def iter_push_items(self) -> Iterator[dict[Any, Any]]:
+        push_items = iter_push_items(self.build_details, self.items_state)
+        if not self.bundles:
+            return push_items
+        wanted = set(self.bundles)
+        return (item for item in push_items if item["src"] in wanted)
+
+    @property
+    def push_items(self) -> list[dict[Any, Any]]:
+        return list(self.iter_push_items())
+
+
+def _union(lists: Iterable[list[Any] | None]) -> list[Any]:
+    return list(dict.fromkeys(item for items in lists for item in items or []))
+
+
+def coalesce_key(operation: IIBOperation) -> str | None:
+    """
+    Return key of operations which can be merged into a single IIB build.
+
+    Only ``add_bundles`` operations are coalesced. They can be merged when
+    they differ in bundles and deprecation list only.
+    """
+    if operation.operation != "add_bundles":
+        return None
+    other_args = {
+        key: value
+        for key, value in operation.op_args.items()
+        if key not in COALESCED_ARGS
+    }
+    return json.dumps(
+        [operation.index_image, operation.items_final_state, other_args],
+        sort_keys=True,
+        default=str,
+    )
+
+
+def coalesce_operations(
+    operations: Iterable[IIBOperation],
+) -> list[tuple[IIBOperation, list[IIBOperation]]]:
+    """
+    Merge ``add_bundles`` operations for the same index into single operations.
+
+    Returns:
+        list: Pairs of operation to submit and original operations it covers.
+    """
+    groups: dict[str, list[IIBOperation]] = {}
+    ordered: list[list[IIBOperation]] = []
+    for operation in operations:
+        key = coalesce_key(operation)
+        if key is None:
+            ordered.append([operation])
+        elif key in groups:
+            groups[key].append(operation)
+        else:
+            groups[key] = [operation]
+            ordered.append(groups[key])
+
+    ret = []
+    for originals in ordered:
+        if len(originals) == 1:
+            ret.append((originals[0], originals))
+            continue
+        first = originals[0]
+        op_args = dict(first.op_args)
+        op_args["bundles"] = _union(op.op_args.get("bundles") for op in originals)
+        deprecation_list = _union(
+            op.op_args.get("deprecation_list") for op in originals
+        )
+        if deprecation_list:
+            op_args["deprecation_list"] = deprecation_list
+        LOG.debug(
+            "Coalescing %d add_bundles operations for %s",
+            len(originals),
+            first.index_image,
+        )
+        merged = IIBOperation(
+            first.operation, first.index_image, op_args, first.items_final_state
+        )
+        ret.append((merged, originals))
+    return ret
+
+
+def filter_push_items(
+    push_items: list[dict[Any, Any]], bundles: list[str] | None
+) -> list[dict[Any, Any]]:
+    """Return push items of a coalesced build which belong to given bundles."""
+    if not bundles:
+        return list(push_items)
+    wanted = set(bundles)
+    return [item for item in push_items if item["src"] in wanted]
+
+
+class IIBOperationEngine:
+    """
+    Execute several IIB operations at once.
+
+    All operations are submitted up front, then their builds are waited on
+    by a single :class:`BuildPoller`. Push items of each build are sent to the
+    collector as soon as the build reaches a terminal state.
+
+    Args:
+        iib_client (IIBClient): Client shared by all operations.
+        collector (pushcollector.Collector): Collector receiving push items.
+        on_complete (callable): Optional callback invoked with
+            :class:`IIBOperationResult` of each finished build.
+        poller (BuildPoller): Poller used to wait for builds. Defaults to
+            a new poller for ``iib_client``.
+        coalesce (bool): Merge ``add_bundles`` operations for the same index
+            into a single IIB build. Each original operation still gets
+            a result with push items of its own bundles.
+        journal (BuildJournal): Optional journal recording submitted builds.
+        resume (bool): Attach to unfinished builds found in ``journal``
+            instead of submitting their requests again.
+        cache_ttl (float): Reuse successful builds of identical requests
+            recorded in ``journal`` in the last ``cache_ttl`` seconds instead
+            of rebuilding the index. Disabled when 0.
+        verify_cache (bool): Reuse a cached build only when IIB confirms it is
+            still the latest successful build of its index.
+        deadline (Deadline): Optional budget of the whole run. Operations are
+            not submitted once it is reached. Waiting for builds is bounded
+            by the deadline of ``poller``.
+        chunk_size (int): Send push items of a build to the collector in
+            chunks of this many items. All at once when 0.
+        retry_policy (RetryPolicy): Optional policy retrying submission of
+            requests on transient errors and resubmitting builds which failed
+            for transient reasons.
+        batch_size (int): Submit add and rm operations in batches of up to
+            this many operations with a single request to IIB. Each operation
+            is submitted separately when 0.
+    """
+
+    def __init__(
+        self,
+        iib_client: IIBClient,
+        collector: Any,
+        on_complete: Callable[[IIBOperationResult], None] | None = None,
+        poller: BuildPoller | None = None,
+        coalesce: bool = False,
+        journal: BuildJournal | None = None,
+        resume: bool = False,
+        cache_ttl: float = 0,
+        verify_cache: bool = False,
+        deadline: Deadline | None = None,
+        chunk_size: int = 0,
+        retry_policy: RetryPolicy | None = None,
+        batch_size: int = 0,
+    ) -> None:
+        self.iib_client = iib_client
+        self.collector = collector
+        self.on_complete = on_complete
+        self.poller = poller or BuildPoller(iib_client)
+        self.coalesce = coalesce
+        self.journal = journal
+        self.resume = resume
+        self.cache_ttl = cache_ttl
+        self.verify_cache = verify_cache
+        self.deadline = deadline
+        self.chunk_size = chunk_size
+        self.retry_policy = retry_policy
+        self.batch_size = batch_size
+
+    def cached_build(self, operation: IIBOperation) -> IIBBuildDetailsModel | None:
+        """Return successful build of an identical request recorded in the journal."""
+        if not self.journal or self.cache_ttl <= 0 or operation.build_id is not None:
+            return None
+        details = self.journal.find_completed(
+            request_fingerprint(operation), self.cache_ttl
+        )
+        if not details:
+            return None
+        if self.verify_cache:
+            details = self._verify_cached(details)
+            if not details:
+                return None
+
+        from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+        LOG.info(
+            "Reusing IIB build %s of identical request for %s",
+            details["id"],
+            operation.index_image,
+        )
+        return IIBBuildDetailsModel.from_dict(details)
+
+    def _verify_cached(self, details: dict[str, Any]) -> dict[str, Any] | None:
+        from_index = details.get("from_index")
+        if from_index:
+            # index rebuilt by any later request invalidates the cached build
+            latest: dict[str, Any] | None = next(
+                iter_builds(
+                    self.iib_client, per_page=1, from_index=from_index, state="complete"
+                ),
+                None,
+            )
+        else:
+            latest = self.iib_client.get_build(details["id"]).to_dict()
+        if not latest or latest["id"] != details["id"] or latest["state"] != "complete":
+            LOG.info("Cached IIB build %s is outdated, rebuilding", details["id"])
+            return None
+        return latest
+
+    def _attach_id(self, operation: IIBOperation) -> Any:
+        build_id = operation.build_id
+        if self.journal and self.resume and build_id is None:
+            build_id = self.journal.find_in_flight(request_fingerprint(operation))
+        return build_id
+
+    def submit(self, operation: IIBOperation) -> IIBBuildDetailsModel:
+        """Submit operation to IIB and mark its push items as pending."""
+        build_id = self._attach_id(operation)
+        if build_id is not None:
+            LOG.info("Attaching to IIB build %s", build_id)
+            build_details = self._call(self.iib_client.get_build, build_id)
+        else:
+            build_details = self._request(operation)
+        self._submitted(operation, build_details)
+        return build_details
+
+    def submit_batch(
+        self, operations: list[IIBOperation]
+    ) -> list[IIBBuildDetailsModel]:
+        """
+        Submit operations to IIB in a single batch and mark their push items as pending.
+
+        Operations which cannot be part of a batch, or which attach to an
+        existing build, are submitted separately.
+
+        Returns:
+            list: Details of the submitted builds in the order of ``operations``.
+        """
+        builds: dict[int, IIBBuildDetailsModel] = {}
+        batched = []
+        for idx, operation in enumerate(operations):
+            if (
+                operation.operation in BATCH_OPERATIONS
+                and self._attach_id(operation) is None
+            ):
+                batched.append(idx)
+            else:
+                builds[idx] = self.submit(operation)
+
+        if batched:
+            batch_builds = self._submit(
+                submit_batch, self.iib_client, [operations[idx] for idx in batched]
+            )
+            for idx, build_details in zip(batched, batch_builds):
+                self._submitted(operations[idx], build_details)
+                builds[idx] = build_details
+        return [builds[idx] for idx in range(len(operations))]
+
+    def _submitted(
+        self, operation: IIBOperation, build_details: IIBBuildDetailsModel
+    ) -> None:
+        if self.journal:
+            self.journal.record(
+                request_fingerprint(operation),
+                build_details.id,
+                build_details.state,
+                "PENDING",
+            )
+
+        LOG.debug("Updating push items")
+        self._send_push_items(build_details, "PENDING")
+
+    def _call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if self.retry_policy:
+            return self.retry_policy.call(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    def _submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if self.retry_policy:
+            return self.retry_policy.submit(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    def _request(self, operation: IIBOperation) -> IIBBuildDetailsModel:
+        LOG.debug("Request to rebuild %s", operation.index_image)
+        bundle_op = getattr(self.iib_client, operation.operation)
+        return self._submit(bundle_op, operation.index_image, **operation.op_args)
+
+    def should_resubmit(
+        self, build_details: IIBBuildDetailsModel, resubmitted: int
+    ) -> bool:
+        """Return True if a finished build failed for a transient reason."""
+        return bool(
+            self.retry_policy
+            and resubmitted < self.retry_policy.resubmit_attempts
+            and self.retry_policy.is_transient_build(build_details)
+        )
+
+    def resubmit(
+        self, operation: IIBOperation, build_details: IIBBuildDetailsModel
+    ) -> IIBBuildDetailsModel:
+        """Submit request of a build which failed for a transient reason again."""
+        LOG.warning(
+            "IIB build %s failed with transient error, resubmitting: %s",
+            build_details.id,
+            build_details.state_reason,
+        )
+        fingerprint = request_fingerprint(operation)
+        if self.journal:
+            self.journal.record(fingerprint, build_details.id, build_details.state)
+        # push items stay PENDING
+        new_build = self._request(operation)
+        if self.journal:
+            self.journal.record(fingerprint, new_build.id, new_build.state, "PENDING")
+        return new_build
+
+    def _send_push_items(self, build_details: IIBBuildDetailsModel, state: str) -> None:
+        send_push_items(
+            self.collector,
+            iter_compact_push_items(build_details, state),
+            self.chunk_size,
+        )
+
+    def cancel(
+        self, operation: IIBOperation, build_details: IIBBuildDetailsModel
+    ) -> None:
+        """Cancel unfinished build in IIB and mark its push items as not pushed."""
+        LOG.warning("Canceling IIB build %s", build_details.id)
+        self.poller.unwatch(build_details.id)
+        try:
+            resp = self.iib_client.iib_session.post(
+                "builds/%s/cancel" % build_details.id
+            )
+            self.iib_client._check_response(resp)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning("Unable to cancel IIB build %s: %s", build_details.id, e)
+
+        self._send_push_items(build_details, "NOTPUSHED")
+        if self.journal:
+            self.journal.record(
+                request_fingerprint(operation),
+                build_details.id,
+                build_details.state,
+                "NOTPUSHED",
+            )
+
+    def finish(
+        self,
+        operation: IIBOperation,
+        build_details: IIBBuildDetailsModel,
+        cached: bool = False,
+    ) -> IIBOperationResult:
+        """
+        Record final push items of a build which reached a terminal state.
+
+        Builds reused from the cache are not recorded in the journal again,
+        so that their age keeps counting from the time they completed.
+        """
+        if build_details.state == "failed":
+            state = "NOTPUSHED"
+        else:
+            state = operation.items_final_state
+        self._send_push_items(build_details, state)
+        if self.journal and not cached:
+            self.journal.record(
+                request_fingerprint(operation),
+                build_details.id,
+                build_details.state,
+                state,
+                build_details.to_dict(),
+            )
+
+        result = IIBOperationResult(operation, build_details, state)
+        if self.on_complete:
+            self.on_complete(result)
+        return result
+
+    def as_completed(
+        self, operations: Iterable[IIBOperation]
+    ) -> Iterator[IIBOperationResult]:
+        """Submit all operations and yield their results in order of completion."""
+        if self.coalesce:
+            groups = coalesce_operations(operations)
+        else:
+            groups = [(operation, [operation]) for operation in operations]
+
+        submitted: dict[Any, tuple[IIBOperation, list[IIBOperation]]] = {}
+        builds: dict[Any, IIBBuildDetailsModel] = {}
+        futures = {}
+        resubmits: dict[Any, int] = {}
+        # operations waiting to be submitted in one batch
+        pending: list[tuple[IIBOperation, list[IIBOperation]]] = []
+
+        def track(
+            group: tuple[IIBOperation, list[IIBOperation]],
+            build_details: IIBBuildDetailsModel,
+        ) -> None:
+            submitted[build_details.id] = group
+            builds[build_details.id] = build_details
+            if build_details.state not in TERMINAL_STATES:
+                futures[build_details.id] = self.poller.watch(build_details)
+
+        def started(
+            group: tuple[IIBOperation, list[IIBOperation]],
+            build_details: IIBBuildDetailsModel,
+        ) -> Iterator[IIBOperationResult]:
+            track(group, build_details)
+            if build_details.state in TERMINAL_STATES:
+                # attached to a build which already finished, no need to poll it
+                yield from finished(build_details)
+
+        def submit_pending() -> Iterator[IIBOperationResult]:
+            if not pending:
+                return
+            batch_builds = self.submit_batch([group[0] for group in pending])
+            groups = list(pending)
+            pending.clear()
+            for group, build_details in zip(groups, batch_builds):
+                yield from started(group, build_details)
+
+        def finished(
+            build_details: IIBBuildDetailsModel,
+        ) -> Iterator[IIBOperationResult]:
+            group = submitted.pop(build_details.id)
+            attempt = resubmits.pop(build_details.id, 0)
+            if self.should_resubmit(build_details, attempt):
+                new_build = self.resubmit(group[0], build_details)
+                track(group, new_build)
+                resubmits[new_build.id] = attempt + 1
+                return
+            yield from self._finish_group(group, build_details)
+
+        try:
+            for operation, originals in groups:
+                cached = self.cached_build(operation)
+                if cached:
+                    yield from self._finish_group(
+                        (operation, originals), cached, cached=True
+                    )
+                    continue
+                if self.deadline and self.deadline.expired:
+                    from iiblib.iib_client import IIBException
+
+                    raise IIBException(
+                        "Deadline reached before submitting request for %s"
+                        % operation.index_image
+                    )
+                if self.batch_size > 0:
+                    pending.append((operation, originals))
+                    if len(pending) >= self.batch_size:
+                        yield from submit_pending()
+                    continue
+                yield from started((operation, originals), self.submit(operation))
+            yield from submit_pending()
+
+            for build_details in self.poller.run():
+                if build_details.id in submitted:
+                    yield from finished(build_details)
+
+            # builds picked up by another user of a shared poller
+            while submitted:
+                build_id = next(iter(submitted))
+                yield from finished(futures[build_id].result())
+        except (Exception, KeyboardInterrupt, SystemExit):
+            # timeout, interrupt or termination, do not leave builds running in IIB
+            for build_id, (operation, __) in submitted.items():
+                self.cancel(operation, builds[build_id])
+            raise
+
+    def _finish_group(
+        self,
+        group: tuple[IIBOperation, list[IIBOperation]],
+        build_details: IIBBuildDetailsModel,
+        cached: bool = False,
+    ) -> Iterator[IIBOperationResult]:
+        operation, originals = group
+        result = self.finish(operation, build_details, cached)
+        if len(originals) == 1 and originals[0] is operation:
+            yield result
+            return
+        for original in originals:
+            yield IIBOperationResult(
+                original,
+                build_details,
+                result.items_state,
+                original.op_args.get("bundles"),
+            )
+
+    def run(self, operations: Iterable[IIBOperation]) -> list[IIBOperationResult]:
+        """Submit all operations, wait for them and return results in input order."""
+        operations = list(operations)
+        results = {id(r.operation): r for r in self.as_completed(operations)}
+        return [results[id(op)] for op in operations]
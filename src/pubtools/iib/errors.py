@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .engine import IIBOperationResult
+
+
+class IIBOperationError(Exception):
+    """IIB operation could not be carried out, e.g. it timed out."""
+
+
+class IIBBuildFailed(IIBOperationError):
+    """
+    IIB build of one or more operations failed.
+
+    Attributes:
+        results (list): :class:`IIBOperationResult` of every operation of
+            the run, including the successful ones.
+    """
+
+    def __init__(self, results: list[IIBOperationResult]) -> None:
+        self.results = results
+        failed = [r.build_details.id for r in results if r.failed]
+        super().__init__("IIB build failed: %s" % ", ".join(str(x) for x in failed))
+
+    @property
+    def failed(self) -> list[IIBOperationResult]:
+        return [result for result in self.results if result.failed]
+
+
+class CircuitOpenError(IIBOperationError):
+    """IIB failed repeatedly and requests are not sent to it for a while."""
@@ -1,20 +1,28 @@
+import contextlib
 import os
 import logging
+import signal
 import sys
-from typing import Any
+import threading
+from typing import Any, Iterator
 from argparse import Namespace, ArgumentParser
 
-import requests
-from iiblib.iib_build_details_model import IIBBuildDetailsModel
-
+from .collector import BufferedCollector
+from .deadline import Deadline
+from .api import IIBOperations
+from .engine import OPERATIONS, IIBOperation, IIBOperationResult
+from .errors import IIBOperationError
+from .journal import BuildJournal, default_journal_path
+from .logs import BuildLogTailer
+from .poller import AdaptiveBackoff
+from .push_items import push_items_from_build  # noqa: F401
+from .retry import TRANSIENT_ERROR_PATTERNS, RetryPolicy, get_circuit_breaker
 from .utils import (
     setup_iib_client,
     setup_arg_parser,
     setup_entry_point_cli,
 )
 
-import pushcollector
-
 LOG = logging.getLogger("pubtools.iib")
 
 
@@ -31,6 +39,47 @@ CMD_ARGS = {
         "required": True,
         "type": str,
     },
+    ("--iib-pool-size",): {
+        "group": "IIB service",
+        "help": "Maximal number of pooled keep-alive connections to IIB",
+        "required": False,
+        "type": int,
+        "default": 10,
+    },
+    ("--iib-timeout",): {
+        "group": "IIB service",
+        "help": "Timeout in seconds of a single HTTP request to IIB",
+        "required": False,
+        "type": float,
+        "default": 30,
+    },
+    ("--iib-retries",): {
+        "group": "IIB service",
+        "help": "Number of retries of failed HTTP requests to IIB",
+        "required": False,
+        "type": int,
+        "default": 3,
+    },
+    ("--iib-submit-rate",): {
+        "group": "IIB service",
+        "help": (
+            "Maximal number of submit requests per second sent to IIB by all"
+            " operations together, 0 for no limit"
+        ),
+        "required": False,
+        "type": float,
+        "default": 0,
+    },
+    ("--iib-poll-rate",): {
+        "group": "IIB service",
+        "help": (
+            "Maximal number of polling requests per second sent to IIB by all"
+            " operations together, 0 for no limit"
+        ),
+        "required": False,
+        "type": float,
+        "default": 0,
+    },
     ("--iib-krb-principal",): {
         "group": "IIB service",
         "help": "IIB kerberos principal in form: name@REALM",
@@ -43,9 +92,28 @@ CMD_ARGS = {
         "required": False,
         "type": str,
     },
+    ("--iib-krb-ccache-dir",): {
+        "group": "IIB service",
+        "help": (
+            "Directory of private kerberos credential caches reused between runs."
+            " Defaults to ~/.cache/pubtools-iib"
+        ),
+        "required": False,
+        "type": str,
+    },
     ("--index-image",): {
         "group": "IIB service",
-        "help": "<hostname>/<namespace>/<image>:<tag> of index image to rebuild",
+        "help": (
+            "<hostname>/<namespace>/<image>:<tag> of index image to rebuild."
+            " Can be specified multiple times to rebuild several indices at once."
+        ),
+        "required": False,
+        "type": str,
+        "action": "append",
+    },
+    ("--index-image-file",): {
+        "group": "IIB service",
+        "help": "File with index images to rebuild, one per line",
         "required": False,
         "type": str,
     },
@@ -88,6 +156,173 @@ CMD_ARGS = {
         "required": False,
         "type": str,
     },
+    ("--push-items-async",): {
+        "group": "IIB service",
+        "help": (
+            "Send push items to pushcollector in batches from a background thread."
+            " Push items superseded before they are sent, e.g. PENDING of a build"
+            " which finished quickly, are sent only in their final state."
+        ),
+        "required": False,
+        "type": bool,
+    },
+    ("--push-items-chunk-size",): {
+        "group": "IIB service",
+        "help": "Send push items of a build to pushcollector in chunks of this size",
+        "required": False,
+        "type": int,
+        "default": 1000,
+    },
+    ("--deadline",): {
+        "group": "IIB service",
+        "help": (
+            "Wall-clock budget of the whole run, either relative (e.g. 3600, 90m, 1h30m)"
+            " or an absolute ISO 8601 timestamp. Unfinished builds are canceled"
+            " once it is reached."
+        ),
+        "required": False,
+        "type": str,
+    },
+    ("--iib-stream-logs",): {
+        "group": "IIB service",
+        "help": "Stream logs of IIB builds into the local log while waiting for them",
+        "required": False,
+        "type": bool,
+    },
+    ("--worker-socket",): {
+        "group": "IIB service",
+        "help": (
+            "Unix socket of a running pubtools-iib-worker."
+            " If set, the request is executed by the worker."
+        ),
+        "required": False,
+        "type": str,
+    },
+    ("--journal",): {
+        "group": "IIB service",
+        "help": (
+            "SQLite journal of submitted IIB builds."
+            " Defaults to ~/.cache/pubtools-iib/journal.sqlite"
+            " with --resume or --cache-ttl"
+        ),
+        "required": False,
+        "type": str,
+    },
+    ("--resume",): {
+        "group": "IIB service",
+        "help": (
+            "Attach to unfinished builds of the same request recorded in the journal"
+            " instead of submitting the request again"
+        ),
+        "required": False,
+        "type": bool,
+    },
+    ("--cache-ttl",): {
+        "group": "IIB service",
+        "help": (
+            "Reuse successful build of an identical request recorded in the journal"
+            " in the last CACHE_TTL seconds instead of rebuilding the index"
+        ),
+        "required": False,
+        "type": float,
+        "default": 0,
+    },
+    ("--cache-verify",): {
+        "group": "IIB service",
+        "help": (
+            "Reuse cached build only when IIB confirms it is still the latest"
+            " successful build of its index"
+        ),
+        "required": False,
+        "type": bool,
+    },
+    ("--attach-build-id",): {
+        "group": "IIB service",
+        "help": "Attach to already submitted IIB build instead of submitting a new one",
+        "required": False,
+        "type": str,
+    },
+    ("--poll-min-interval",): {
+        "group": "IIB service",
+        "help": (
+            "Shortest interval in seconds between polls of IIB build state,"
+            " used once a build is being processed"
+        ),
+        "required": False,
+        "type": float,
+        "default": 30,
+    },
+    ("--poll-max-interval",): {
+        "group": "IIB service",
+        "help": (
+            "Longest interval in seconds between polls of IIB build state"
+            " while a build is waiting in the queue"
+        ),
+        "required": False,
+        "type": float,
+        "default": 60,
+    },
+    ("--submit-batch-size",): {
+        "group": "IIB service",
+        "help": (
+            "Submit requests for several index images in batches of up to this"
+            " many requests with a single call of the IIB add-rm-batch endpoint."
+            " IIB processes builds of a batch one after another."
+            " 0 submits each request separately."
+        ),
+        "required": False,
+        "type": int,
+        "default": 0,
+    },
+    ("--retry-attempts",): {
+        "group": "IIB service",
+        "help": (
+            "Attempts of polling a build when IIB is unreachable or fails with"
+            " a server error, and of submitting a build when IIB cannot be"
+            " connected to, on top of --iib-retries"
+        ),
+        "required": False,
+        "type": int,
+        "default": 3,
+    },
+    ("--resubmit-attempts",): {
+        "group": "IIB service",
+        "help": (
+            "Number of times a build which failed for a transient reason,"
+            " see --transient-error-pattern, is submitted again"
+        ),
+        "required": False,
+        "type": int,
+        "default": 0,
+    },
+    ("--transient-error-pattern",): {
+        "group": "IIB service",
+        "help": (
+            "Regular expression matching state_reason of builds which failed"
+            " for a transient reason. Can be specified multiple times,"
+            " replaces the built-in patterns."
+        ),
+        "required": False,
+        "type": str,
+        "action": "append",
+    },
+    ("--circuit-breaker-threshold",): {
+        "group": "IIB service",
+        "help": (
+            "Fail fast after this many consecutive failed requests to IIB,"
+            " 0 to disable"
+        ),
+        "required": False,
+        "type": int,
+        "default": 5,
+    },
+    ("--circuit-breaker-reset",): {
+        "group": "IIB service",
+        "help": "Seconds to wait before contacting IIB again once it failed fast",
+        "required": False,
+        "type": float,
+        "default": 60,
+    },
 }
 
 ADD_CMD_ARGS = CMD_ARGS.copy()
@@ -148,52 +383,12 @@ ADD_DEPRECATIONS_CMD_ARGS[("--operator-package",)] = {
     "type": str,
 }
 
-
-def push_items_from_build(
-    build_details: IIBBuildDetailsModel, state: str
-) -> list[dict[Any, Any]]:
-    ret = []
-    if build_details.request_type == "add":
-        for operator, bundles in build_details.bundle_mapping.items():
-            for bundle in bundles:
-                item = {
-                    "state": state,
-                    "origin": build_details.from_index or "scratch",
-                    "src": bundle,
-                    "filename": operator,
-                    "dest": "redhat-operator-index",
-                    "build": build_details.index_image,
-                    "signing_key": None,
-                    "checksums": None,
-                }
-                ret.append(item)
-    elif build_details.request_type == "rm":
-        for operator in build_details.removed_operators:
-            item = {
-                "state": state,
-                "origin": build_details.from_index,
-                "src": None,
-                "filename": operator,
-                "dest": "redhat-operator-index",
-                "build": build_details.index_image,
-                "signing_key": None,
-                "checksums": None,
-            }
-            ret.append(item)
-    elif build_details.request_type == "add-deprecations":
-        item = {
-            "state": state,
-            "origin": build_details.from_index,
-            "src": None,
-            "filename": build_details.operator_package,
-            "dest": "redhat-operator-index",
-            "build": build_details.index_image,
-            "signing_key": None,
-            "checksums": None,
-        }
-        ret.append(item)
-
-    return ret
+# operation -> (arguments, final state of push items)
+OPERATION_ARGS = {
+    "add_bundles": (ADD_CMD_ARGS, "PUSHED"),
+    "remove_operators": (RM_CMD_ARGS, "DELETED"),
+    "add_deprecations": (ADD_DEPRECATIONS_CMD_ARGS, "PUSHED"),
+}
 
 
 def process_parsed_args(parsed_args: Namespace, args: dict[Any, Any]) -> Namespace:
@@ -213,22 +408,23 @@ def process_parsed_args(parsed_args: Namespace, args: dict[Any, Any]) -> Namespa
     return parsed_args
 
 
-def _iib_op_main(
-    args: Namespace,
-    operation: str | None = None,
-    items_final_state: str = "PUSHED",
-) -> list[dict[Any, Any]] | Any:
-    if operation not in ("add_bundles", "remove_operators", "add_deprecations"):
-        raise ValueError("Must set iib operation")
-
-    pc = pushcollector.Collector.get()
-    LOG.debug("Initializing iib client")
-    iib_c = setup_iib_client(args)
-    LOG.debug("Request to rebuild %s", args.index_image)
+def _index_images(args: Namespace) -> list[str | None]:
+    index_images = args.index_image or []
+    if isinstance(index_images, str):
+        index_images = [index_images]
+    index_images = list(index_images)
+    if args.index_image_file:
+        with open(args.index_image_file) as index_image_file:
+            for line in index_image_file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    index_images.append(line)
+    # no index image means the index is built from scratch
+    return index_images or [None]
 
-    bundle_op = getattr(iib_c, operation)
 
-    extra_args = {}
+def _make_op_args(args: Namespace, operation: str) -> dict[str, Any]:
+    extra_args: dict[str, Any] = {}
     if operation == "add_bundles":
         if args.deprecation_list:
             extra_args["deprecation_list"] = args.deprecation_list.split(",")
@@ -254,29 +450,181 @@ def _iib_op_main(
 
     if args.build_tag:
         extra_args["build_tags"] = args.build_tag
+    return extra_args
 
-    build_details = bundle_op(args.index_image, **extra_args)
 
-    push_items = push_items_from_build(build_details, "PENDING")
-    LOG.debug("Updating push items")
-    pc.update_push_items(push_items)
+def _run_operations(
+    args: Namespace,
+    operation: str,
+    items_final_state: str = "PUSHED",
+    collector: Any = None,
+) -> list[IIBOperationResult]:
+    # imported here to keep startup of the CLI fast
+    import pushcollector
+    import requests
+
+    deadline = Deadline.parse(args.deadline) if args.deadline else None
+    pc = collector or pushcollector.Collector.get()
+    if args.push_items_async:
+        pc = BufferedCollector(pc)
+    LOG.debug("Initializing iib client")
+    iib_c = setup_iib_client(args)
 
-    build_details = iib_c.wait_for_build(build_details)
+    extra_args = _make_op_args(args, operation)
+    operations = [
+        IIBOperation(operation, index_image, extra_args, items_final_state)
+        for index_image in _index_images(args)
+    ]
+    if args.attach_build_id:
+        if len(operations) != 1:
+            raise ValueError("--attach-build-id can be used with a single index image")
+        operations[0].build_id = args.attach_build_id
+
+    journal = None
+    if args.journal or args.resume or args.cache_ttl:
+        journal = BuildJournal(args.journal or default_journal_path())
+        if args.cache_ttl:
+            journal.evict(args.cache_ttl)
+
+    tailers: dict[Any, BuildLogTailer] = {}
+
+    def tail_logs(build_details: Any) -> None:
+        tailer = tailers.setdefault(
+            build_details.id, BuildLogTailer(iib_c.iib_session, build_details.id)
+        )
+        try:
+            tailer.tail()
+        except requests.RequestException as e:
+            LOG.warning("Unable to fetch logs of IIB build %s: %s", build_details.id, e)
+
+    def on_complete(result: IIBOperationResult) -> None:
+        build_details_url = _make_iib_build_details_url(
+            args.iib_server, result.build_details.id
+        )
+        if args.iib_stream_logs:
+            tail_logs(result.build_details)
+            tailers[result.build_details.id].flush()
+        LOG.info("IIB details: %s", build_details_url)
+        if result.failed:
+            LOG.error("IIB operation failed")
+            print_error_message(
+                build_details_url, iib_c.iib_session, result.build_details
+            )
+
+    breaker = None
+    if args.circuit_breaker_threshold:
+        breaker = get_circuit_breaker(
+            args.iib_server, args.circuit_breaker_threshold, args.circuit_breaker_reset
+        )
+    retry_policy = RetryPolicy(
+        attempts=args.retry_attempts or 1,
+        resubmit_attempts=args.resubmit_attempts or 0,
+        transient_patterns=args.transient_error_pattern or TRANSIENT_ERROR_PATTERNS,
+        breaker=breaker,
+    )
+
+    iib_ops = IIBOperations(
+        iib_c,
+        pc,
+        backoff=AdaptiveBackoff(args.poll_min_interval, args.poll_max_interval),
+        on_update=tail_logs if args.iib_stream_logs else None,
+        on_complete=on_complete,
+        journal=journal,
+        resume=args.resume,
+        cache_ttl=args.cache_ttl or 0,
+        verify_cache=args.cache_verify,
+        chunk_size=args.push_items_chunk_size or 0,
+        retry_policy=retry_policy,
+        batch_size=args.submit_batch_size or 0,
+    )
+    if args.build_timeout:
+        iib_ops.build_timeout = int(args.build_timeout)
+    try:
+        return iib_ops.run(operations, deadline=deadline, check=False)
+    except IIBOperationError as e:
+        # entry points keep raising IIBException and requests errors
+        if e.__cause__ is None:
+            raise
+        raise e.__cause__ from None
+    finally:
+        if journal:
+            journal.close()
+        if isinstance(pc, BufferedCollector):
+            pc.close()
+
+
+def _forward_to_worker(
+    args: Namespace, operation: str, items_final_state: str
+) -> tuple[list[Any], bool]:
+    # imported here to keep startup of the CLI fast
+    import pushcollector
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+    from .worker import submit_to_worker
+
+    request_args = vars(args).copy()
+    del request_args["worker_socket"]
+    LOG.debug("Forwarding request to worker at %s", args.worker_socket)
+    response = submit_to_worker(
+        args.worker_socket, operation, request_args, items_final_state
+    )
+
+    pushcollector.Collector.get().update_push_items(response["push_items"])
+    builds = [IIBBuildDetailsModel.from_dict(bd) for bd in response["builds"]]
+    for build_details in builds:
+        LOG.info(
+            "IIB details: %s",
+            _make_iib_build_details_url(args.iib_server, build_details.id),
+        )
+    return builds, response["failed"]
+
+
+@contextlib.contextmanager
+def _exit_on_sigterm() -> Iterator[None]:
+    """Turn SIGTERM into SystemExit, so outstanding builds get canceled."""
+
+    def terminate(signum: int, frame: Any) -> None:
+        LOG.error("Terminated, canceling outstanding IIB builds")
+        raise SystemExit(128 + signum)
+
+    # signal handlers can be installed from the main thread only
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(signal.SIGTERM, terminate)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
 
-    build_details_url = _make_iib_build_details_url(args.iib_server, build_details.id)
-    LOG.info("IIB details: %s", build_details_url)
 
-    if build_details.state == "failed":
-        LOG.error("IIB operation failed")
-        print_error_message(build_details_url)
-        push_items = push_items_from_build(build_details, "NOTPUSHED")
-        pc.update_push_items(push_items)
+def _iib_op_main(
+    args: Namespace,
+    operation: str | None = None,
+    items_final_state: str = "PUSHED",
+) -> list[dict[Any, Any]] | Any:
+    if operation not in OPERATIONS:
+        raise ValueError("Must set iib operation")
+
+    if args.worker_socket:
+        builds, failed = _forward_to_worker(args, operation, items_final_state)
+    else:
+        with _exit_on_sigterm():
+            try:
+                results = _run_operations(args, operation, items_final_state)
+            except KeyboardInterrupt:
+                LOG.error("Interrupted, outstanding IIB builds were canceled")
+                sys.exit(130)
+        builds = [result.build_details for result in results]
+        failed = any(result.failed for result in results)
+
+    if failed:
         sys.exit(1)
 
-    push_items = push_items_from_build(build_details, items_final_state)
-    pc.update_push_items(push_items)
     LOG.info("IIB build finished")
-    return build_details
+    if len(builds) == 1:
+        return builds[0]
+    return builds
 
 
 def make_add_bundles_parser() -> ArgumentParser:
@@ -338,14 +686,34 @@ def _make_iib_build_details_url(host: str, task_id: str) -> str:
     return "https://%s/api/v1/builds/%s" % (host, task_id)
 
 
-def print_error_message(iib_build_url: str) -> None:
+def print_error_message(
+    iib_build_url: str, iib_session: Any = None, build_details: Any = None
+) -> None:
     """
     Construct and print an error message for IIB failure.
 
+    The error is taken from ``build_details`` when available. Build details
+    are fetched from IIB only if they are missing or lack the state reason.
+
     Args:
         iib_build_url (str): URL of the IIB build.
+        iib_session (IIBSession): Optional session of IIBClient used to fetch
+            build details. Reuses its pooled connections and authentication.
+        build_details (IIBBuildDetailsModel): Optional details of the failed build.
     """
-    res = requests.get(iib_build_url, timeout=30).json()
-
-    LOG.error("IIB Failed with the error: '%s'", res["state_reason"])
-    LOG.error("Please check the full logs at %s", f"{iib_build_url.rstrip('/')}/logs")
+    import requests
+
+    state_reason = build_details.state_reason if build_details else None
+    logs = build_details.logs if build_details else None
+    if not state_reason:
+        if iib_session:
+            resp = iib_session.session.get(iib_build_url, verify=iib_session.verify)
+        else:
+            resp = requests.get(iib_build_url, timeout=30)
+        res = resp.json()
+        state_reason = res["state_reason"]
+        logs = res.get("logs")
+
+    logs_url = (logs or {}).get("url") or f"{iib_build_url.rstrip('/')}/logs"
+    LOG.error("IIB Failed with the error: '%s'", state_reason)
+    LOG.error("Please check the full logs at %s", logs_url)
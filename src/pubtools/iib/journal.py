@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .engine import IIBOperation
+
+# arguments whose order does not change the resulting index
+_UNORDERED_ARGS = ("bundles", "operators", "arches", "deprecation_list", "build_tags")
+# arguments which don't change the resulting index and must not be persisted
+_IGNORED_ARGS = ("overwrite_from_index_token",)
+
+
+def request_fingerprint(operation: IIBOperation) -> str:
+    """
+    Return canonical fingerprint of an IIB request.
+
+    Two operations have the same fingerprint when they would produce the
+    same IIB build, regardless of order of bundles, operators, arches,
+    deprecation list and build tags.
+    """
+    op_args = {}
+    for key, value in operation.op_args.items():
+        if key in _IGNORED_ARGS or value is None:
+            continue
+        if key in _UNORDERED_ARGS:
+            value = sorted(set(value))
+        op_args[key] = value
+    canonical = json.dumps(
+        [operation.operation, operation.index_image, op_args],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def default_journal_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "pubtools-iib", "journal.sqlite")
+
+
+class BuildJournal:
+    """
+    Local journal of submitted IIB builds.
+
+    Every submitted request is recorded together with its fingerprint and
+    build id before waiting on the build, and updated once the build
+    finishes. A rerun after a crash can look up builds which are still in
+    flight and attach to them instead of submitting the request again.
+
+    Details of successful builds are kept as well, so identical requests
+    repeated within a TTL can reuse the existing build instead of rebuilding
+    the index.
+
+    Args:
+        path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS builds ("
+                " fingerprint TEXT NOT NULL,"
+                " build_id NOT NULL,"
+                " state TEXT NOT NULL,"
+                " items_state TEXT,"
+                " details TEXT,"
+                " created REAL NOT NULL,"
+                " updated REAL NOT NULL,"
+                " completed REAL,"
+                " PRIMARY KEY (fingerprint, build_id))"
+            )
+
+    def record(
+        self,
+        fingerprint: str,
+        build_id: Any,
+        state: str,
+        items_state: str | None = None,
+        details: dict[str, Any] | None = None,
+    ) -> None:
+        """
+        Record current state of a build, of its push items and its details.
+
+        The time a build is first recorded in a terminal state is kept as its
+        completion time, later records of the same build do not change it.
+        """
+        now = time.time()
+        completed = now if state in ("complete", "failed") else None
+        details_json = json.dumps(details) if details is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO builds"
+                " (fingerprint, build_id, state, items_state, details,"
+                " created, updated, completed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (fingerprint, build_id) DO UPDATE SET"
+                " state = excluded.state,"
+                " items_state = excluded.items_state,"
+                " details = COALESCE(excluded.details, details),"
+                " updated = excluded.updated,"
+                " completed = COALESCE(completed, excluded.completed)",
+                (
+                    fingerprint,
+                    build_id,
+                    state,
+                    items_state,
+                    details_json,
+                    now,
+                    now,
+                    completed,
+                ),
+            )
+
+    def find_in_flight(self, fingerprint: str) -> Any:
+        """Return id of the latest unfinished build of a request, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT build_id FROM builds"
+                " WHERE fingerprint = ? AND state NOT IN ('complete', 'failed')"
+                " ORDER BY created DESC LIMIT 1",
+                (fingerprint,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_completed(self, fingerprint: str, max_age: float) -> Any:
+        """
+        Return details of the latest successful build of a request.
+
+        Args:
+            fingerprint (str): Fingerprint of the request.
+            max_age (float): Ignore builds finished more than this many seconds ago.
+
+        Returns:
+            dict: Build details as returned by IIB, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT details FROM builds"
+                " WHERE fingerprint = ? AND state = 'complete'"
+                " AND details IS NOT NULL AND completed >= ?"
+                " ORDER BY completed DESC LIMIT 1",
+                (fingerprint, time.time() - max_age),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def evict(self, max_age: float) -> int:
+        """Remove builds finished more than ``max_age`` seconds ago, return their count."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM builds"
+                " WHERE state IN ('complete', 'failed') AND completed < ?",
+                (time.time() - max_age,),
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
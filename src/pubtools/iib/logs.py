@@ -0,0 +1,76 @@
+import logging
+from typing import Any
+
+LOG = logging.getLogger("pubtools.iib")
+
+
+class BuildLogTailer:
+    """
+    Incrementally stream logs of an IIB build into the local log.
+
+    Each call of :meth:`tail` requests only the part of the log which was not
+    seen yet (using an HTTP Range header) and processes the response in
+    chunks, so the whole log is never held in memory.
+
+    Args:
+        iib_session (IIBSession): Session of IIBClient used to fetch the logs.
+        build_id (int): ID of the IIB build.
+        chunk_size (int): Size of chunks the log is read in.
+    """
+
+    def __init__(self, iib_session: Any, build_id: Any, chunk_size: int = 65536):
+        self.iib_session = iib_session
+        self.build_id = build_id
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self._partial = b""
+
+    def _log_line(self, line: bytes) -> None:
+        LOG.info(
+            "[IIB build %s] %s",
+            self.build_id,
+            line.rstrip(b"\r").decode("utf-8", errors="replace"),
+        )
+
+    def tail(self) -> int:
+        """
+        Fetch and log new content of the build log.
+
+        Returns:
+            int: Number of new bytes read.
+        """
+        headers = {"Range": "bytes=%d-" % self.offset} if self.offset else {}
+        resp = self.iib_session.get(
+            "builds/%s/logs" % self.build_id, headers=headers, stream=True
+        )
+        try:
+            # 404: logs not available (yet), 416: nothing new since offset
+            if resp.status_code in (404, 416):
+                return 0
+            resp.raise_for_status()
+
+            # server ignored the range request and sent the whole log
+            skip = self.offset if resp.status_code != 206 else 0
+            read = 0
+            for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                if not chunk:
+                    continue
+                read += len(chunk)
+                lines = (self._partial + chunk).split(b"\n")
+                self._partial = lines.pop()
+                for line in lines:
+                    self._log_line(line)
+            self.offset += read
+            return read
+        finally:
+            resp.close()
+
+    def flush(self) -> None:
+        """Log the last incomplete line of the log, if any."""
+        if self._partial:
+            self._log_line(self._partial)
+            self._partial = b""
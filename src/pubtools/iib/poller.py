@@ -0,0 +1,403 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+
+if TYPE_CHECKING:
+    from .deadline import Deadline
+    from .retry import RetryPolicy
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+    from iiblib.iib_client import IIBClient
+
+LOG = logging.getLogger("pubtools.iib")
+
+TERMINAL_STATES = ("complete", "failed")
+
+# seconds to wait after a polling round failed, doubled with each failure
+ERROR_BACKOFF = 1
+MAX_ERROR_BACKOFF = 120
+
+# largest page of the builds list IIB returns
+MAX_PER_PAGE = 100
+
+
+def iter_builds(
+    iib_client: IIBClient, per_page: int = MAX_PER_PAGE, **filters: Any
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield details of builds matching filters from the paginated builds list.
+
+    Further pages are requested only when the caller keeps iterating, so
+    stopping early saves requests to IIB.
+
+    Args:
+        iib_client (IIBClient): Client whose session is used for the requests.
+        per_page (int): Number of builds requested per page.
+        filters: Filters of the builds list endpoint, e.g. ``batch``,
+            ``state`` or ``from_index``.
+
+    Yields:
+        dict: Verbose build details as returned by IIB.
+    """
+    page = 1
+    while True:
+        resp = iib_client.iib_session.get(
+            "builds",
+            params=dict(filters, verbose=True, per_page=per_page, page=page),
+        )
+        iib_client._check_response(resp)
+        data = resp.json()
+        yield from data.get("items") or []
+        if not (data.get("meta") or {}).get("next"):
+            return
+        page += 1
+
+
+class AdaptiveBackoff:
+    """
+    Polling interval which adapts to the state of watched builds.
+
+    The default ``min_interval`` matches the fixed interval of
+    ``IIBClient.wait_for_build``, so no build is polled more often than
+    before. Builds waiting in the queue are polled less often.
+
+    While a build waits in the IIB queue the interval grows exponentially
+    from ``min_interval`` up to ``max_interval``. Once ``state_history`` shows
+    the build was picked up by a worker, it is polled every ``min_interval``
+    seconds again. Each interval is randomized by ``jitter`` so that many
+    clients do not poll IIB in lockstep.
+
+    Args:
+        min_interval (float): Shortest interval between polls in seconds.
+        max_interval (float): Longest interval between polls in seconds.
+        factor (float): Multiplier applied per poll of a queued build.
+        jitter (float): Relative random deviation applied to each interval.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 30,
+        max_interval: float = 60,
+        factor: float = 2,
+        jitter: float = 0.2,
+    ) -> None:
+        if min_interval > max_interval:
+            raise ValueError("Minimal poll interval is greater than maximal")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+
+    @staticmethod
+    def started(build_details: IIBBuildDetailsModel) -> bool:
+        """Return True if the build left the queue and is being processed."""
+        # the first history entry is always the initial "request was initiated"
+        return len(build_details.state_history or []) > 1
+
+    def interval(self, build_details: IIBBuildDetailsModel, polls: int) -> float:
+        """Return seconds to wait before polling build again."""
+        if self.started(build_details):
+            interval = self.min_interval
+        else:
+            interval = self.min_interval * self.factor**polls
+        interval *= 1 + random.uniform(-self.jitter, self.jitter)  # nosec B311
+        return float(min(max(interval, self.min_interval), self.max_interval))
+
+
+class _WatchedBuild:
+    __slots__ = ("build_details", "future", "deadline", "polls", "started")
+
+    def __init__(
+        self,
+        build_details: IIBBuildDetailsModel,
+        future: "Future[IIBBuildDetailsModel]",
+        deadline: float,
+    ) -> None:
+        self.build_details = build_details
+        self.future = future
+        self.deadline = deadline
+        self.polls = 0
+        # monotonic time the build was seen being processed by IIB
+        self.started: float | None = None
+
+
+def _resolve(resolved: list[tuple[_WatchedBuild, Any, Exception | None]]) -> None:
+    for item, build_details, exc in resolved:
+        if exc:
+            item.future.set_exception(exc)
+        else:
+            item.future.set_result(build_details)
+
+
+class BuildPoller:
+    """
+    Poll state of many IIB builds on a single schedule.
+
+    Instead of running one ``IIBClient.wait_for_build`` loop per build, all
+    watched builds are refreshed together in one polling round. Builds which
+    share an IIB batch are fetched from the paginated builds list endpoint,
+    which takes one request per page of up to :data:`MAX_PER_PAGE` builds
+    instead of one per build. Builds missing from the list are fetched
+    one by one. Waiters get a future for each watched build which is resolved
+    once the build reaches a terminal state.
+
+    Args:
+        iib_client (IIBClient): Client used to query IIB.
+        poll_interval (int): Seconds to wait between polling rounds, used
+            when no ``backoff`` is set.
+        timeout (int): Seconds to wait for a single build before giving up.
+        backoff (AdaptiveBackoff): Optional strategy computing the interval
+            between polling rounds from the state of watched builds.
+        on_update (callable): Optional callback invoked with fresh details of
+            every watched build after each polling round.
+        deadline (Deadline): Optional budget shared by all watched builds.
+            Builds are given up once it is reached, and builds still queued
+            are given up early when builds finished so far took longer than
+            the remaining budget.
+        retry_policy (RetryPolicy): Optional policy retrying polling rounds
+            which failed on transient errors.
+    """
+
+    def __init__(
+        self,
+        iib_client: IIBClient,
+        poll_interval: float = 30,
+        timeout: float = 7200,
+        backoff: AdaptiveBackoff | None = None,
+        on_update: Callable[[IIBBuildDetailsModel], None] | None = None,
+        deadline: Deadline | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        self.iib_client = iib_client
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.backoff = backoff
+        self.on_update = on_update
+        self.deadline = deadline
+        self.retry_policy = retry_policy
+        self._run_times: list[float] = []
+        # consecutive polling rounds which failed to fetch builds
+        self._fetch_errors = 0
+        self._lock = threading.Lock()
+        self._watched: dict[Any, _WatchedBuild] = {}
+
+    def watch(
+        self, build_details: IIBBuildDetailsModel
+    ) -> "Future[IIBBuildDetailsModel]":
+        """Start tracking build and return future resolved with its final details."""
+        with self._lock:
+            watched = self._watched.get(build_details.id)
+            if watched:
+                return watched.future
+            future: "Future[IIBBuildDetailsModel]" = Future()
+            future.set_running_or_notify_cancel()
+            deadline = time.monotonic() + self.timeout
+            if self.deadline:
+                deadline = min(deadline, self.deadline.expires)
+            self._watched[build_details.id] = _WatchedBuild(
+                build_details, future, deadline
+            )
+            return future
+
+    def unwatch(self, build_id: Any) -> None:
+        """Stop tracking build, its future fails with ``CancelledError``."""
+        with self._lock:
+            watched = self._watched.pop(build_id, None)
+        if watched:
+            watched.future.set_exception(CancelledError())
+
+    @property
+    def pending(self) -> int:
+        """Number of builds which did not reach terminal state yet."""
+        with self._lock:
+            return len(self._watched)
+
+    def _fetch_batch(self, batch: Any, build_ids: list[Any]) -> dict[Any, Any]:
+        from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+        wanted = set(build_ids)
+        fetched = {}
+        for item in iter_builds(self.iib_client, batch=batch):
+            if item["id"] not in wanted:
+                # finished earlier or watched by someone else
+                continue
+            fetched[item["id"]] = IIBBuildDetailsModel.from_dict(item)
+            wanted.discard(item["id"])
+            if not wanted:
+                break
+        return fetched
+
+    def _fetch(self, watched: list[_WatchedBuild]) -> dict[Any, Any]:
+        by_batch: dict[Any, list[Any]] = {}
+        for item in watched:
+            by_batch.setdefault(item.build_details.batch, []).append(
+                item.build_details.id
+            )
+
+        fetched: dict[Any, Any] = {}
+        for batch, build_ids in by_batch.items():
+            if batch is not None and len(build_ids) > 1:
+                LOG.debug("Polling %d builds of batch %s", len(build_ids), batch)
+                fetched.update(self._fetch_batch(batch, build_ids))
+            for build_id in build_ids:
+                if build_id not in fetched:
+                    fetched[build_id] = self.iib_client.get_build(build_id)
+        return fetched
+
+    def _poll_round(self) -> tuple[list[IIBBuildDetailsModel], list[Exception]]:
+        from iiblib.iib_client import IIBException
+
+        with self._lock:
+            watched = list(self._watched.values())
+        if not watched:
+            return [], []
+
+        try:
+            if self.retry_policy:
+                fetched = self.retry_policy.call(self._fetch, watched)
+            else:
+                fetched = self._fetch(watched)
+        except Exception:
+            self._fetch_errors += 1
+            # builds past their deadline must not wait for IIB to come back
+            expired = self._expire(watched, time.monotonic())
+            if expired:
+                return [], expired
+            raise
+        self._fetch_errors = 0
+        if self.on_update:
+            for item in watched:
+                self.on_update(fetched[item.build_details.id])
+
+        finished = []
+        timed_out: list[Exception] = []
+        # futures are resolved outside the lock, their callbacks may unwatch builds
+        resolved: list[tuple[_WatchedBuild, Any, Exception | None]] = []
+        now = time.monotonic()
+        with self._lock:
+            for item in watched:
+                build_details = fetched[item.build_details.id]
+                if item.started is None and AdaptiveBackoff.started(build_details):
+                    item.started = now
+                if build_details.state in TERMINAL_STATES:
+                    if self._watched.pop(item.build_details.id, None) is None:
+                        # unwatched meanwhile
+                        continue
+                    if item.started is not None:
+                        self._run_times.append(now - item.started)
+                    resolved.append((item, build_details, None))
+                    finished.append(build_details)
+                    continue
+
+                if now >= item.deadline:
+                    message = self._timeout_message(build_details.id, now)
+                elif item.started is None and self._cannot_finish(now):
+                    message = (
+                        "Build request %s is still queued and cannot finish"
+                        " before the deadline." % build_details.id
+                    )
+                else:
+                    item.build_details = build_details
+                    item.polls += 1
+                    continue
+
+                if self._watched.pop(item.build_details.id, None) is None:
+                    continue
+                exc = IIBException(message)
+                resolved.append((item, None, exc))
+                timed_out.append(exc)
+        _resolve(resolved)
+        return finished, timed_out
+
+    def _timeout_message(self, build_id: Any, now: float) -> str:
+        if self.deadline and now >= self.deadline.expires:
+            return (
+                "Deadline reached. Build request %s was not processed"
+                " before the deadline." % build_id
+            )
+        return "Timeout reached. Build request %s was not processed in %d seconds." % (
+            build_id,
+            self.timeout,
+        )
+
+    def _expire(self, watched: list[_WatchedBuild], now: float) -> list[Exception]:
+        """Give up builds past their deadline, return errors set to their futures."""
+        from iiblib.iib_client import IIBException
+
+        timed_out: list[Exception] = []
+        resolved: list[tuple[_WatchedBuild, Any, Exception | None]] = []
+        with self._lock:
+            for item in watched:
+                if now < item.deadline:
+                    continue
+                if self._watched.pop(item.build_details.id, None) is None:
+                    continue
+                exc = IIBException(self._timeout_message(item.build_details.id, now))
+                resolved.append((item, None, exc))
+                timed_out.append(exc)
+        _resolve(resolved)
+        return timed_out
+
+    def _cannot_finish(self, now: float) -> bool:
+        """Return True if a build starting now would likely miss the deadline."""
+        if not self.deadline or not self._run_times:
+            return False
+        return now + max(self._run_times) > self.deadline.expires
+
+    def next_interval(self) -> float:
+        """Return seconds to wait before the next polling round."""
+        with self._lock:
+            watched = list(self._watched.values())
+        if not watched:
+            return 0
+        if self.backoff:
+            interval = min(
+                self.backoff.interval(item.build_details, item.polls)
+                for item in watched
+            )
+        else:
+            interval = self.poll_interval
+        if self._fetch_errors:
+            # IIB is failing, wait longer after every failed round
+            interval = max(
+                interval,
+                min(ERROR_BACKOFF * 2 ** (self._fetch_errors - 1), MAX_ERROR_BACKOFF),
+            )
+        # do not oversleep the nearest timeout
+        until_deadline = min(item.deadline for item in watched) - time.monotonic()
+        return max(min(interval, until_deadline), 0)
+
+    def poll(self) -> list[IIBBuildDetailsModel]:
+        """
+        Refresh all watched builds once.
+
+        Returns:
+            list: Details of builds which reached terminal state in this round.
+
+        Raises:
+            IIBException: When a build was not finished before the timeout.
+        """
+        finished, timed_out = self._poll_round()
+        if timed_out:
+            raise timed_out[0]
+        return finished
+
+    def run(self) -> Iterator[IIBBuildDetailsModel]:
+        """
+        Poll until no build is watched, yielding builds as they finish.
+
+        Raises:
+            IIBException: When a build was not finished before the timeout.
+        """
+        while True:
+            finished, timed_out = self._poll_round()
+            yield from finished
+            if timed_out:
+                raise timed_out[0]
+            if not self.pending:
+                return
+            time.sleep(self.next_interval())
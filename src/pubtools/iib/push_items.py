@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
+
+if TYPE_CHECKING:
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+
+class _SharedFields:
+    """Push item fields common to all push items of a build."""
+
+    __slots__ = ("origin", "dest", "build", "signing_key", "checksums")
+
+    def __init__(
+        self,
+        origin: str | None,
+        build: str | None,
+        dest: str = "redhat-operator-index",
+        signing_key: str | None = None,
+        checksums: dict[str, str] | None = None,
+    ) -> None:
+        self.origin = origin
+        self.dest = dest
+        self.build = build
+        self.signing_key = signing_key
+        self.checksums = checksums
+
+
+class CompactPushItem:
+    """
+    Push item holding only its own fields.
+
+    Fields which are the same for every push item of a build are held once
+    and shared by all of them. Items are converted to dicts expected by
+    pushcollector by :meth:`to_dict` only when they are sent.
+    """
+
+    __slots__ = ("state", "src", "filename", "_shared")
+
+    def __init__(
+        self, state: str, src: str | None, filename: str, shared: _SharedFields
+    ) -> None:
+        self.state = state
+        self.src = src
+        self.filename = filename
+        self._shared = shared
+
+    def with_state(self, state: str) -> CompactPushItem:
+        """Return the same push item in a different state."""
+        return CompactPushItem(state, self.src, self.filename, self._shared)
+
+    def to_dict(self) -> dict[Any, Any]:
+        shared = self._shared
+        return {
+            "state": self.state,
+            "origin": shared.origin,
+            "src": self.src,
+            "filename": self.filename,
+            "dest": shared.dest,
+            "build": shared.build,
+            "signing_key": shared.signing_key,
+            "checksums": shared.checksums,
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactPushItem):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return "CompactPushItem(%r)" % self.to_dict()
+
+
+def iter_compact_push_items(
+    build_details: IIBBuildDetailsModel, state: str
+) -> Iterator[CompactPushItem]:
+    """Yield push items of a build one by one, in ``state``."""
+    if build_details.request_type == "add":
+        shared = _SharedFields(
+            build_details.from_index or "scratch", build_details.index_image
+        )
+        for operator, bundles in build_details.bundle_mapping.items():
+            for bundle in bundles:
+                yield CompactPushItem(state, bundle, operator, shared)
+    elif build_details.request_type == "rm":
+        shared = _SharedFields(build_details.from_index, build_details.index_image)
+        for operator in build_details.removed_operators:
+            yield CompactPushItem(state, None, operator, shared)
+    elif build_details.request_type == "add-deprecations":
+        shared = _SharedFields(build_details.from_index, build_details.index_image)
+        yield CompactPushItem(state, None, build_details.operator_package, shared)
+
+
+def iter_push_items(
+    build_details: IIBBuildDetailsModel, state: str
+) -> Iterator[dict[Any, Any]]:
+    """Yield push items of a build one by one as dicts, in ``state``."""
+    return (item.to_dict() for item in iter_compact_push_items(build_details, state))
+
+
+def push_items_from_build(
+    build_details: IIBBuildDetailsModel, state: str
+) -> list[dict[Any, Any]]:
+    return list(iter_push_items(build_details, state))
+
+
+def _as_dict(item: CompactPushItem | dict[Any, Any]) -> dict[Any, Any]:
+    if isinstance(item, CompactPushItem):
+        return item.to_dict()
+    return item
+
+
+def send_push_items(
+    collector: Any,
+    push_items: Iterable[CompactPushItem | dict[Any, Any]],
+    chunk_size: int = 0,
+) -> None:
+    """
+    Send push items to collector in chunks of ``chunk_size`` items.
+
+    Only one chunk is held in memory at a time when ``push_items`` is
+    a generator. All items are sent at once when ``chunk_size`` is 0.
+    :class:`CompactPushItem` items are converted to dicts on the way.
+    """
+    iterator = (_as_dict(item) for item in push_items)
+    if not chunk_size:
+        collector.update_push_items(list(iterator))
+        return
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        collector.update_push_items(chunk)
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import logging
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterable, TypeVar
+
+from .errors import CircuitOpenError
+
+if TYPE_CHECKING:
+    from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+LOG = logging.getLogger("pubtools.iib")
+
+T = TypeVar("T")
+
+# state_reason of failed builds worth submitting again
+TRANSIENT_ERROR_PATTERNS = (
+    r"timed? ?out",
+    r"temporar(y|ily)",
+    r"connection (reset|refused|aborted)",
+    r"too many requests",
+    r"\b(429|502|503|504)\b",
+    r"service unavailable",
+    r"TLS handshake",
+    r"unexpected EOF",
+)
+
+_BREAKERS: dict[tuple[Any, ...], "CircuitBreaker"] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Return True if a request failed for a reason which may go away by itself."""
+    import requests
+
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.RetryError):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def is_connect_error(exc: BaseException) -> bool:
+    """Return True if a request failed before it could reach the server."""
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError
+
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.ConnectionError) and exc.args:
+        # requests wraps urllib3 MaxRetryError, which carries the original error
+        reason = getattr(exc.args[0], "reason", exc.args[0])
+        return isinstance(reason, ConnectTimeoutError)
+    return False
+
+
+class CircuitBreaker:
+    """
+    Fail fast while IIB is down.
+
+    After ``failure_threshold`` transient failures in a row the circuit opens
+    and every call fails immediately with :class:`CircuitOpenError`. After
+    ``reset_timeout`` seconds a single trial call is let through, the circuit
+    closes again when it succeeds.
+
+    Args:
+        failure_threshold (int): Consecutive failures opening the circuit.
+        reset_timeout (float): Seconds to keep the circuit open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self) -> None:
+        """
+        Check whether a call may be made.
+
+        Raises:
+            CircuitOpenError: When the circuit is open.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(
+                    "IIB is unavailable after %d consecutive failures" % self._failures
+                )
+            # let a single trial call through
+            self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                LOG.info("IIB is available again")
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def abort_trial(self) -> None:
+        """Let another trial call through after the current one was interrupted."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial or (
+                self._opened_at is None and self._failures >= self.failure_threshold
+            ):
+                LOG.warning(
+                    "IIB failed %d times in a row, not contacting it for %ds",
+                    self._failures,
+                    self.reset_timeout,
+                )
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+def get_circuit_breaker(
+    server: str, failure_threshold: int = 5, reset_timeout: float = 60
+) -> CircuitBreaker:
+    """Return circuit breaker shared by all operations against ``server``."""
+    key = (server, failure_threshold, reset_timeout)
+    with _BREAKERS_LOCK:
+        if key not in _BREAKERS:
+            _BREAKERS[key] = CircuitBreaker(failure_threshold, reset_timeout)
+        return _BREAKERS[key]
+
+
+class RetryPolicy:
+    """
+    Retry of IIB requests and builds failing for transient reasons.
+
+    Requests failing on transport errors, see :func:`is_transient_error`, are
+    retried with exponential backoff and jitter. Submissions of new builds
+    are retried only when they did not reach IIB, see :meth:`submit`. Builds
+    which failed with ``state_reason`` matching one of ``transient_patterns``
+    can be submitted again up to ``resubmit_attempts`` times.
+
+    Args:
+        attempts (int): Maximal number of attempts of a single request.
+        backoff_factor (float): Seconds to wait before the first retry,
+            doubled with every further retry.
+        max_backoff (float): Longest wait between retries.
+        resubmit_attempts (int): Times a build failed for a transient reason
+            is submitted again.
+        transient_patterns (list): Regular expressions matched against
+            ``state_reason`` of failed builds, case-insensitively.
+        breaker (CircuitBreaker): Optional breaker failing requests fast
+            while IIB is down.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff_factor: float = 2,
+        max_backoff: float = 60,
+        resubmit_attempts: int = 0,
+        transient_patterns: Iterable[str] = TRANSIENT_ERROR_PATTERNS,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self.attempts = max(attempts, 1)
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.resubmit_attempts = resubmit_attempts
+        self.transient_re = re.compile(
+            "|".join("(?:%s)" % pattern for pattern in transient_patterns) or "(?!)",
+            re.IGNORECASE,
+        )
+        self.breaker = breaker
+
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call ``func`` retrying transient failures.
+
+        Raises:
+            CircuitOpenError: When the circuit breaker is open.
+            Exception: Error of the last attempt, or any error which is not
+                transient.
+        """
+        return self._call(is_transient_error, func, *args, **kwargs)
+
+    def submit(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call ``func`` submitting a new request to IIB.
+
+        Submissions are not idempotent, IIB may have accepted a request which
+        failed on a read timeout or a server error. Only requests which did
+        not reach IIB at all are retried, so that no build is submitted twice.
+        """
+        return self._call(is_connect_error, func, *args, **kwargs)
+
+    def _call(
+        self,
+        retryable: Callable[[BaseException], bool],
+        func: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        attempt = 1
+        while True:
+            if self.breaker:
+                self.breaker.before_call()
+            try:
+                ret = func(*args, **kwargs)
+            except Exception as e:
+                transient = is_transient_error(e)
+                if self.breaker:
+                    if transient:
+                        self.breaker.record_failure()
+                    else:
+                        # any other answer proves IIB is up
+                        self.breaker.record_success()
+                if not (transient and retryable(e)) or attempt >= self.attempts:
+                    raise
+                delay = min(self.backoff_factor * 2 ** (attempt - 1), self.max_backoff)
+                delay *= random.uniform(0.5, 1)  # nosec B311
+                LOG.warning(
+                    "IIB request failed (%s), retrying in %.1fs (%d/%d)",
+                    e,
+                    delay,
+                    attempt,
+                    self.attempts - 1,
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                if self.breaker:
+                    self.breaker.abort_trial()
+                raise
+            if self.breaker:
+                self.breaker.record_success()
+            return ret
+
+    def is_transient_build(self, build_details: IIBBuildDetailsModel) -> bool:
+        """Return True if the build failed for a reason worth submitting it again."""
+        if build_details.state != "failed":
+            return False
+        return bool(self.transient_re.search(build_details.state_reason or ""))
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Iterable
+
+from .api import _set_exception, _set_result
+from .errors import IIBBuildFailed
+
+if TYPE_CHECKING:
+    from .api import IIBOperations
+    from .engine import IIBOperation, IIBOperationResult
+
+LOG = logging.getLogger("pubtools.iib")
+
+
+class _Scheduled:
+    __slots__ = ("operation", "future", "inner")
+
+    def __init__(
+        self, operation: IIBOperation, future: "Future[IIBOperationResult]"
+    ) -> None:
+        self.operation = operation
+        self.future = future
+        self.inner: "Future[IIBOperationResult] | None" = None
+
+
+class IndexScheduler:
+    """
+    Run operations on different indices in parallel and on the same index in order.
+
+    Concurrent operations on the same index race in IIB and with
+    ``overwrite_from_index`` one of them silently overwrites the result of
+    the other. The scheduler queues operations by their index image. Only
+    one operation of each index runs at a time, at most ``max_concurrency``
+    operations run in total.
+
+    Operations on the same index are chained: once a build succeeds, the
+    next operation of that index is based on its output. Operations with
+    ``overwrite_from_index`` keep their index image, as IIB already wrote the
+    output of the previous build to it. Operations without an index image
+    are not serialized.
+
+    Args:
+        iib_ops (IIBOperations): API used to start operations.
+        max_concurrency (int): Maximal number of operations running at once.
+        check (bool): Fail futures with :class:`IIBBuildFailed` when the
+            build of their operation failed.
+    """
+
+    def __init__(
+        self, iib_ops: IIBOperations, max_concurrency: int = 4, check: bool = True
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.iib_ops = iib_ops
+        self.max_concurrency = max_concurrency
+        self.check = check
+        self._lock = threading.Lock()
+        self._queues: dict[Any, deque[_Scheduled]] = {}
+        self._order: deque[Any] = deque()
+        self._busy: set[Any] = set()
+        self._running = 0
+        self._outputs: dict[str, str] = {}
+        self._unkeyed = 0
+
+    def schedule(self, operation: IIBOperation) -> "Future[IIBOperationResult]":
+        """
+        Queue operation and return future of its result.
+
+        Cancelling the future of a queued operation removes it from the
+        queue, cancelling a running one cancels its build.
+        """
+        future: "Future[IIBOperationResult]" = Future()
+        item = _Scheduled(operation, future)
+
+        def on_cancel(f: "Future[IIBOperationResult]") -> None:
+            if f.cancelled() and item.inner:
+                item.inner.cancel()
+
+        future.add_done_callback(on_cancel)
+        with self._lock:
+            key: Any = operation.index_image
+            if key is None:
+                # builds from scratch do not touch any existing index
+                self._unkeyed += 1
+                key = ("scratch", self._unkeyed)
+            if key not in self._queues:
+                self._queues[key] = deque()
+                self._order.append(key)
+            self._queues[key].append(item)
+        self._dispatch()
+        return future
+
+    def run(self, operations: Iterable[IIBOperation]) -> list[IIBOperationResult]:
+        """
+        Schedule operations, wait for all of them and return results in order.
+
+        When waiting is interrupted, operations which did not finish are
+        cancelled.
+        """
+        futures = [self.schedule(operation) for operation in operations]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _dispatch(self) -> None:
+        to_start = []
+        with self._lock:
+            for key in list(self._order):
+                if self._running >= self.max_concurrency:
+                    break
+                if key in self._busy:
+                    continue
+                queue = self._queues[key]
+                while queue and queue[0].future.cancelled():
+                    queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                    self._order.remove(key)
+                    continue
+                item = queue.popleft()
+                self._busy.add(key)
+                self._running += 1
+                to_start.append((key, item))
+
+        for key, item in to_start:
+            self._start(key, item)
+
+    def _chained(self, operation: IIBOperation) -> IIBOperation:
+        output = self._outputs.get(operation.index_image or "")
+        if not output or operation.op_args.get("overwrite_from_index"):
+            return operation
+        LOG.debug(
+            "Chaining operation on %s to output of previous build %s",
+            operation.index_image,
+            output,
+        )
+        return dataclasses.replace(operation, index_image=output)
+
+    def _start(self, key: Any, item: _Scheduled) -> None:
+        with self._lock:
+            operation = self._chained(item.operation)
+        try:
+            item.inner = self.iib_ops.submit(operation, check=False)
+        except Exception as e:  # pylint: disable=broad-except
+            self._done(key, item, None, e)
+            return
+        item.inner.add_done_callback(lambda f: self._on_inner_done(key, item, f))
+        if item.future.cancelled():
+            # cancelled while being started
+            item.inner.cancel()
+
+    def _on_inner_done(
+        self, key: Any, item: _Scheduled, inner: "Future[IIBOperationResult]"
+    ) -> None:
+        if inner.cancelled():
+            self._done(key, item, None, None)
+            return
+        exc = inner.exception()
+        self._done(key, item, None if exc else inner.result(), exc)
+
+    def _done(
+        self,
+        key: Any,
+        item: _Scheduled,
+        result: IIBOperationResult | None,
+        exc: BaseException | None,
+    ) -> None:
+        with self._lock:
+            if result and not result.failed and item.operation.index_image:
+                self._outputs[item.operation.index_image] = (
+                    result.build_details.index_image
+                )
+            self._busy.discard(key)
+            self._running -= 1
+
+        if exc:
+            _set_exception(item.future, exc)
+        elif result and self.check and result.failed:
+            _set_exception(item.future, IIBBuildFailed([result]))
+        elif result:
+            _set_result(item.future, result)
+        self._dispatch()
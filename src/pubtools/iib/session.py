@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from typing import Any
+
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOG = logging.getLogger("pubtools.iib")
+
+_ADAPTERS: dict[tuple[Any, ...], HTTPAdapter] = {}
+_ADAPTERS_LOCK = threading.Lock()
+
+# responses asking the client to slow down
+_THROTTLED_STATUSES = (429, 503)
+_SUBMIT_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Args:
+        rate (float): Tokens added per second, 0 for no limit.
+        burst (float): Maximal number of tokens, defaults to ``rate`` but at
+            least 1.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self) -> float:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.rate:
+            return 0
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        # tolerate rounding of the refill above
+        if self._tokens >= 1 - 1e-9:
+            self._tokens = max(self._tokens - 1, 0)
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Take a token, waiting until one is available. Return seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next ``seconds``."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Rate limits of IIB requests shared by all threads.
+
+    Requests changing state in IIB (submits) and reading it (polls) have
+    separate budgets. When IIB responds with ``Retry-After``, both are paused
+    for the requested time, so all threads back off together instead of
+    retrying in lockstep.
+
+    Args:
+        submit_rate (float): Submit requests per second, 0 for no limit.
+        poll_rate (float): Poll requests per second, 0 for no limit.
+    """
+
+    def __init__(self, submit_rate: float = 0, poll_rate: float = 0) -> None:
+        self.submit = TokenBucket(submit_rate)
+        self.poll = TokenBucket(poll_rate)
+
+    def acquire(self, method: str | None) -> None:
+        bucket = self.submit if (method or "").upper() in _SUBMIT_METHODS else self.poll
+        waited = bucket.acquire()
+        if waited:
+            LOG.debug("Rate limited %s request for %.2fs", method, waited)
+
+    def pause(self, seconds: float) -> None:
+        LOG.debug("IIB asked to retry after %.2fs, pausing requests", seconds)
+        self.submit.pause(seconds)
+        self.poll.pause(seconds)
+
+
+class _RateLimitedRetry(Retry):
+    """Retry sharing ``Retry-After`` of the server with other threads."""
+
+    rate_limiter: RateLimiter | None = None
+
+    def new(self, **kw: Any) -> "_RateLimitedRetry":
+        retry = super().new(**kw)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def sleep_for_retry(self, response: Any) -> bool:
+        retry_after = self.get_retry_after(response)
+        if retry_after and self.rate_limiter:
+            self.rate_limiter.pause(retry_after)
+        return bool(super().sleep_for_retry(response))
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter applying default timeout to requests which don't set one.
+
+    With ``rate_limiter`` set, every request waits for its rate limit and
+    throttled responses pause the limiter for the time IIB asks for.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        timeout: float | None = None,
+        rate_limiter: RateLimiter | None = None,
+        **kwargs: Any,
+    ):
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        super().__init__(*args, **kwargs)
+
+    def send(self, request: PreparedRequest, **kwargs: Any) -> Response:  # type: ignore[override]
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        if self.rate_limiter:
+            self.rate_limiter.acquire(getattr(request, "method", None))
+        response = super().send(request, **kwargs)
+        if self.rate_limiter and response.status_code in _THROTTLED_STATUSES:
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after:
+                self.rate_limiter.pause(retry_after)
+        return response
+
+
+def _parse_retry_after(value: str | None) -> float:
+    if not value:
+        return 0
+    try:
+        return max(float(Retry().parse_retry_after(value)), 0)
+    except Exception:  # pylint: disable=broad-except
+        return 0
+
+
+def get_http_adapter(
+    pool_size: int = 10,
+    timeout: float = 30,
+    retries: int = 3,
+    submit_rate: float = 0,
+    poll_rate: float = 0,
+) -> HTTPAdapter:
+    """
+    Return HTTP adapter shared by all IIB sessions in the process.
+
+    Connection pools live in the adapter, so mounting the same adapter to
+    every session lets concurrent operations reuse keep-alive TLS connections.
+
+    Args:
+        pool_size (int): Maximal number of connections kept per host.
+        timeout (float): Default timeout of a request in seconds.
+        retries (int): Number of retries of failed requests.
+        submit_rate (float): Submit requests per second, 0 for no limit.
+        poll_rate (float): Poll requests per second, 0 for no limit.
+    """
+    key = (pool_size, timeout, retries, submit_rate, poll_rate)
+    with _ADAPTERS_LOCK:
+        if key not in _ADAPTERS:
+            rate_limiter = RateLimiter(submit_rate, poll_rate)
+            retry = _RateLimitedRetry(
+                total=retries,
+                read=retries,
+                connect=retries,
+                backoff_factor=2,
+                status_forcelist={429} | set(range(500, 512)),
+            )
+            retry.rate_limiter = rate_limiter
+            _ADAPTERS[key] = TimeoutHTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=retry,
+                timeout=timeout,
+                rate_limiter=rate_limiter,
+            )
+        return _ADAPTERS[key]
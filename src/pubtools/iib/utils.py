@@ -1,20 +1,29 @@
+from __future__ import annotations
+
 import argparse
 import contextlib
 import os
 import sys
-import pkg_resources
-from typing import Any
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from iiblib.iib_client import IIBClient
 
-from iiblib import iib_client, iib_authentication
 
+def setup_iib_client(parsed_args: argparse.Namespace) -> IIBClient:
+    # imported here to keep startup of the CLI fast
+    from iiblib import iib_client
 
-def setup_iib_client(parsed_args: argparse.Namespace) -> iib_client.IIBClient:
-    iib_auth = iib_authentication.IIBKrbAuth(
+    from .auth import CachedKrbAuth
+    from .session import get_http_adapter
+
+    iib_auth = CachedKrbAuth.get(
         parsed_args.iib_krb_principal,
         parsed_args.iib_server,
         ktfile=parsed_args.iib_krb_ktfile,
+        ccache_dir=parsed_args.iib_krb_ccache_dir,
     )
-    kwargs = {
+    kwargs: dict[str, Any] = {
         "auth": iib_auth,
     }
     if parsed_args.iib_insecure:
@@ -22,6 +31,16 @@ def setup_iib_client(parsed_args: argparse.Namespace) -> iib_client.IIBClient:
     if parsed_args.build_timeout:
         kwargs["wait_for_build_timeout"] = int(parsed_args.build_timeout)
     iibc = iib_client.IIBClient(parsed_args.iib_server, **kwargs)
+
+    adapter = get_http_adapter(
+        pool_size=parsed_args.iib_pool_size,
+        timeout=parsed_args.iib_timeout,
+        retries=parsed_args.iib_retries,
+        submit_rate=parsed_args.iib_submit_rate or 0,
+        poll_rate=parsed_args.iib_poll_rate or 0,
+    )
+    iibc.iib_session.session.mount("https://", adapter)
+    iibc.iib_session.session.mount("http://", adapter)
     return iibc
 
 
@@ -54,6 +73,16 @@ def setup_arg_parser(args: dict[Any, Any]) -> argparse.ArgumentParser:
     return parser
 
 
+def load_entry_point(dist: str, group: str, name: str) -> Any:
+    """Load entry point ``name`` from ``group`` of distribution ``dist``."""
+    from importlib.metadata import distribution
+
+    for entry_point in distribution(dist).entry_points:
+        if entry_point.group == group and entry_point.name == name:
+            return entry_point.load()
+    raise ImportError("Entry point %r not found" % ((group, name),))
+
+
 @contextlib.contextmanager
 def setup_entry_point_cli(
     entry_tuple: tuple[str, str, str],
@@ -73,7 +102,7 @@ def setup_entry_point_cli(
         sys.argv.extend(args)
         for key in environ_vars:
             os.environ[key] = environ_vars[key]
-        entry_point_func = pkg_resources.load_entry_point(*entry_tuple)
+        entry_point_func = load_entry_point(*entry_tuple)
         yield entry_point_func
     finally:
         sys.argv = orig_argv[:]
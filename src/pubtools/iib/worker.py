@@ -0,0 +1,302 @@
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Any
+
+from .engine import filter_push_items
+from .iib_ops import OPERATION_ARGS, _run_operations
+from .utils import setup_arg_parser
+
+LOG = logging.getLogger("pubtools.iib")
+
+WORKER_CMD_ARGS = {
+    ("--socket",): {
+        "group": "Worker",
+        "help": "Path of unix socket the worker listens on",
+        "required": True,
+        "type": str,
+    },
+    ("--coalesce-window",): {
+        "group": "Worker",
+        "help": (
+            "Seconds to collect add-bundles requests for the same index and submit"
+            " them as a single IIB build. Disabled by default."
+        ),
+        "required": False,
+        "type": float,
+        "default": 0,
+    },
+    ("--debug",): {
+        "group": "Worker",
+        "help": "Enable debug logging",
+        "required": False,
+        "type": bool,
+    },
+}
+
+
+class WorkerError(Exception):
+    """Request could not be executed by the worker."""
+
+
+class _RecordingCollector:
+    """Collector keeping push items of a single request to be returned to the client."""
+
+    def __init__(self) -> None:
+        self.items: list[dict[Any, Any]] = []
+        self._lock = threading.Lock()
+
+    def update_push_items(self, items: list[dict[Any, Any]]) -> None:
+        with self._lock:
+            self.items.extend(items)
+
+
+class _CoalescedGroup:
+    """add_bundles requests collected during one coalescing window."""
+
+    def __init__(self) -> None:
+        self.requests: list[Namespace] = []
+        self.done = threading.Event()
+        self.response: dict[str, Any] = {}
+        self.error: Exception | None = None
+
+
+def _merge_add_requests(requests: list[Namespace]) -> Namespace:
+    merged = Namespace(**vars(requests[0]))
+    merged.bundle = list(
+        dict.fromkeys(bundle for args in requests for bundle in args.bundle or [])
+    )
+    deprecation_list = dict.fromkeys(
+        bundle
+        for args in requests
+        for bundle in (args.deprecation_list or "").split(",")
+        if bundle
+    )
+    merged.deprecation_list = ",".join(deprecation_list) or None
+    return merged
+
+
+def make_namespace(cmd_args: dict[Any, Any], request_args: dict[str, Any]) -> Namespace:
+    """
+    Create arguments of an operation from a request.
+
+    Args:
+        cmd_args (dict): Arguments definition, e.g. ``ADD_CMD_ARGS``.
+        request_args (dict): Argument values keyed by argument name, either
+            in option (``--index-image``) or attribute (``index_image``) form.
+
+    Returns:
+        Namespace: Arguments with defaults applied.
+    """
+    values = {
+        key.lstrip("-").replace("-", "_"): value for key, value in request_args.items()
+    }
+    ns = Namespace()
+    for aliases, arg_data in cmd_args.items():
+        named_alias = [
+            x.lstrip("-").replace("-", "_") for x in aliases if x.startswith("--")
+        ][0]
+        value = values.get(named_alias)
+        if value is None:
+            value = arg_data.get("default")
+        if value is None and arg_data.get("required"):
+            raise WorkerError("Missing required argument: %s" % aliases[0])
+        setattr(ns, named_alias, value)
+    return ns
+
+
+class IIBWorker(socketserver.ThreadingUnixStreamServer):
+    """
+    Resident process executing IIB operations on behalf of CLI invocations.
+
+    Requests are accepted on a unix socket, one JSON document per line::
+
+        {"operation": "add_bundles", "args": {"iib_server": ..., ...}}
+
+    Each request is executed in its own thread. Kerberos tickets and HTTP
+    connections are shared between requests, so they are not paid again for
+    every push.
+
+    With ``coalesce_window`` set, add_bundles requests which differ only in
+    bundles and deprecation list are collected for that many seconds and
+    submitted as a single IIB build. Every client still receives push items
+    of its own bundles only.
+
+    Args:
+        socket_path (str): Path of unix socket to listen on.
+        coalesce_window (float): Seconds to collect add_bundles requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, coalesce_window: float = 0) -> None:
+        self.coalesce_window = coalesce_window
+        self._groups: dict[str, _CoalescedGroup] = {}
+        self._groups_lock = threading.Lock()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # requests carry registry tokens, only the owner may connect
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.socket_path = socket_path
+
+    def execute(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Execute single request and return the response document."""
+        operation = request.get("operation")
+        if operation not in OPERATION_ARGS:
+            raise WorkerError("Unsupported iib operation: %s" % operation)
+        cmd_args, items_final_state = OPERATION_ARGS[operation]
+        args = make_namespace(cmd_args, request.get("args") or {})
+        # never forward the request again
+        args.worker_socket = None
+        items_final_state = request.get("items_final_state") or items_final_state
+
+        if operation == "add_bundles" and self.coalesce_window > 0:
+            return self._execute_coalesced(args, items_final_state)
+        return self._execute(args, operation, items_final_state)
+
+    def _execute(
+        self, args: Namespace, operation: str, items_final_state: str
+    ) -> dict[str, Any]:
+        collector = _RecordingCollector()
+        results = _run_operations(
+            args, operation, items_final_state, collector=collector
+        )
+        return {
+            "ok": True,
+            "failed": any(result.failed for result in results),
+            "builds": [result.build_details.to_dict() for result in results],
+            "push_items": collector.items,
+        }
+
+    def _execute_coalesced(
+        self, args: Namespace, items_final_state: str
+    ) -> dict[str, Any]:
+        request_args = vars(args).copy()
+        del request_args["bundle"]
+        del request_args["deprecation_list"]
+        key = json.dumps([request_args, items_final_state], sort_keys=True, default=str)
+
+        with self._groups_lock:
+            group = self._groups.get(key)
+            leader = group is None
+            if group is None:
+                group = self._groups[key] = _CoalescedGroup()
+            group.requests.append(args)
+
+        if leader:
+            time.sleep(self.coalesce_window)
+            with self._groups_lock:
+                del self._groups[key]
+            LOG.info("Coalescing %d add-bundles requests", len(group.requests))
+            try:
+                group.response = self._execute(
+                    _merge_add_requests(group.requests),
+                    "add_bundles",
+                    items_final_state,
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                group.error = e
+            finally:
+                group.done.set()
+        else:
+            group.done.wait()
+
+        if group.error:
+            raise group.error
+        return dict(
+            group.response,
+            push_items=filter_push_items(group.response["push_items"], args.bundle),
+        )
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: IIBWorker
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.execute(request)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception("Worker request failed")
+            response = {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+def submit_to_worker(
+    socket_path: str,
+    operation: str,
+    args: dict[str, Any],
+    items_final_state: str | None = None,
+) -> dict[str, Any]:
+    """
+    Send request to a running worker and wait for the response.
+
+    Args:
+        socket_path (str): Unix socket of the worker.
+        operation (str): Name of the operation, e.g. ``add_bundles``.
+        args (dict): Arguments of the operation.
+        items_final_state (str): Optional final state of push items.
+
+    Returns:
+        dict: Response with ``builds`` and ``push_items`` of the request.
+
+    Raises:
+        WorkerError: When the worker failed to execute the request.
+    """
+    request = {"operation": operation, "args": args}
+    if items_final_state:
+        request["items_final_state"] = items_final_state
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            stream.flush()
+            response: dict[str, Any] = json.loads(stream.readline())
+
+    if not response.get("ok"):
+        raise WorkerError(response.get("error"))
+    return response
+
+
+def make_worker_parser() -> ArgumentParser:
+    return setup_arg_parser(WORKER_CMD_ARGS)
+
+
+def worker_main(sysargs: list[str] | None = None) -> None:
+    parser = make_worker_parser()
+    if sysargs:
+        args = parser.parse_args(sysargs[1:])
+    else:
+        args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    worker = IIBWorker(args.socket, coalesce_window=args.coalesce_window)
+
+    def stop(signum: int, frame: Any) -> None:
+        # shutdown() blocks until serve_forever() returns, call it from another thread
+        threading.Thread(target=worker.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    LOG.info("Worker listening on %s", args.socket)
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.server_close()
@@ -0,0 +1,42 @@
+import mock
+import pytest
+
+from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+from utils import FakeTaskManager
+
+
+@pytest.fixture
+def fake_tm():
+    return FakeTaskManager()
+
+
+@pytest.fixture
+def fake_iib_client(fake_tm):
+    client = mock.MagicMock(name="IIBClient")
+    client.add_bundles.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, **kwargs)
+        )
+    )
+    client.remove_operators.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, **dict(kwargs, op_type="rm"))
+        )
+    )
+    client.get_build.side_effect = lambda build_id: IIBBuildDetailsModel.from_dict(
+        fake_tm.get_task(build_id)
+    )
+    return client
+
+
+@pytest.fixture
+def make_build(fake_tm):
+    """Return factory of builds adding bundle1 to index-image."""
+
+    def make(**kwargs):
+        return IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task("index-image", bundles=["bundle1"], **kwargs)
+        )
+
+    return make
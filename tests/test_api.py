@@ -0,0 +1,180 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+from pubtools.iib import IIBBuildFailed, IIBOperationError, IIBOperations
+from pubtools.iib.poller import AdaptiveBackoff
+
+from utils import FakeCollector
+
+
+@pytest.fixture
+def iib_ops(fake_iib_client):
+    return IIBOperations(
+        fake_iib_client,
+        FakeCollector(),
+        backoff=AdaptiveBackoff(min_interval=0, max_interval=0),
+    )
+
+
+def test_add_bundles(iib_ops, fake_iib_client):
+    result = iib_ops.add_bundles("index-image", bundles=["bundle1"], arches=None)
+
+    fake_iib_client.add_bundles.assert_called_once_with(
+        "index-image", bundles=["bundle1"]
+    )
+    assert not result.failed
+    assert [i["state"] for i in result.push_items] == ["PUSHED"]
+    assert [i["state"] for i in iib_ops.collector.items] == ["PENDING", "PUSHED"]
+
+
+def test_remove_operators(iib_ops, fake_iib_client):
+    result = iib_ops.remove_operators("index-image", ["operator-1"])
+
+    assert [(i["filename"], i["state"]) for i in result.push_items] == [
+        ("operator-1", "DELETED")
+    ]
+
+
+def test_build_failed(iib_ops, fake_iib_client, fake_tm):
+    fake_iib_client.add_bundles.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, state_seq=("in_progress", "failed"), **kwargs)
+        )
+    )
+
+    with pytest.raises(IIBBuildFailed) as exc_info:
+        iib_ops.add_bundles("index-image", bundles=["bundle1"])
+
+    assert [r.build_details.id for r in exc_info.value.failed] == ["task-0"]
+    assert [i["state"] for i in exc_info.value.results[0].push_items] == ["NOTPUSHED"]
+
+
+def test_timeout(iib_ops, fake_iib_client, fake_tm):
+    fake_iib_client.add_bundles.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, state_seq=["in_progress"] * 3, **kwargs)
+        )
+    )
+    iib_ops.build_timeout = 0
+
+    with pytest.raises(IIBOperationError, match="Timeout reached"):
+        iib_ops.add_bundles("index-image", bundles=["bundle1"])
+
+
+def test_request_error(iib_ops, fake_iib_client):
+    error = requests.ConnectionError("unreachable")
+    fake_iib_client.add_bundles.side_effect = error
+
+    with pytest.raises(IIBOperationError, match="unreachable") as exc_info:
+        iib_ops.add_bundles("index-image", bundles=["bundle1"])
+    assert exc_info.value.__cause__ is error
+
+    future = iib_ops.add_bundles_async("index-image", bundles=["bundle1"])
+    exc = future.exception(timeout=10)
+    iib_ops.shutdown()
+    assert isinstance(exc, IIBOperationError)
+    assert exc.__cause__ is error
+
+
+def test_concurrent_calls(iib_ops, fake_iib_client, fake_tm):
+    lock = threading.Lock()
+
+    def add_bundles(*args, **kwargs):
+        with lock:
+            return IIBBuildDetailsModel.from_dict(fake_tm.setup_task(*args, **kwargs))
+
+    fake_iib_client.add_bundles.side_effect = add_bundles
+    indices = ["index-%d" % i for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(
+                lambda index: iib_ops.add_bundles(index, bundles=["bundle1"]), indices
+            )
+        )
+
+    assert [r.build_details.from_index for r in results] == indices
+    assert len(iib_ops.collector.items) == 16
+
+
+def test_add_bundles_async(iib_ops, fake_iib_client):
+    futures = [
+        iib_ops.add_bundles_async(index, bundles=["bundle1"])
+        for index in ("index-1", "index-2")
+    ]
+
+    results = [f.result(timeout=10) for f in futures]
+    iib_ops.shutdown()
+
+    assert [r.build_details.from_index for r in results] == ["index-1", "index-2"]
+    assert sorted(i["state"] for i in iib_ops.collector.items) == [
+        "PENDING",
+        "PENDING",
+        "PUSHED",
+        "PUSHED",
+    ]
+
+
+def test_async_build_failed(iib_ops, fake_iib_client, fake_tm):
+    fake_iib_client.remove_operators.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(
+                *args, state_seq=("in_progress", "failed"), op_type="rm", **kwargs
+            )
+        )
+    )
+
+    future = iib_ops.remove_operators_async("index-image", ["operator-1"])
+
+    assert isinstance(future.exception(timeout=10), IIBBuildFailed)
+    iib_ops.shutdown()
+
+
+def test_async_cancel(iib_ops, fake_iib_client, fake_tm):
+    submitted = threading.Event()
+
+    def add_bundles(*args, **kwargs):
+        task = fake_tm.setup_task(*args, state_seq=["in_progress"] * 100, **kwargs)
+        submitted.set()
+        return IIBBuildDetailsModel.from_dict(task)
+
+    fake_iib_client.add_bundles.side_effect = add_bundles
+    iib_ops.backoff = AdaptiveBackoff(min_interval=60, max_interval=60)
+
+    future = iib_ops.add_bundles_async("index-image", bundles=["bundle1"])
+    assert submitted.wait(10)
+    iib_ops.shutdown()
+
+    assert future.cancel()
+    fake_iib_client.iib_session.post.assert_called_once_with("builds/task-0/cancel")
+    assert [i["state"] for i in iib_ops.collector.items] == ["PENDING", "NOTPUSHED"]
+
+
+def test_async_timeout_while_iib_unreachable(iib_ops, fake_iib_client):
+    fake_iib_client.get_build.side_effect = requests.ConnectionError("unreachable")
+    iib_ops.build_timeout = 0.3
+
+    future = iib_ops.add_bundles_async("index-image", bundles=["bundle1"])
+
+    exc = future.exception(timeout=10)
+    iib_ops.shutdown()
+    assert isinstance(exc, IIBOperationError)
+    assert "Timeout reached" in str(exc)
+    # polling backs off instead of hammering IIB
+    assert fake_iib_client.get_build.call_count < 10
+
+
+def test_async_after_shutdown(iib_ops, fake_iib_client):
+    first = iib_ops.add_bundles_async("index-1", bundles=["bundle1"])
+    first.result(timeout=10)
+    iib_ops.shutdown()
+
+    second = iib_ops.add_bundles_async("index-2", bundles=["bundle1"])
+
+    assert second.result(timeout=10).build_details.from_index == "index-2"
+    iib_ops.shutdown()
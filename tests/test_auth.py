@@ -0,0 +1,202 @@
+import os
+import time
+
+import mock
+import pytest
+
+from pubtools.iib.auth import CachedKrbAuth, ticket_end_time
+
+KLIST_OUTPUT = """Ticket cache: FILE:%s
+Default principal: user@REALM
+
+Valid starting       Expires              Service principal
+%s  %s  krbtgt/REALM@REALM
+\trenew until %s
+"""
+
+
+def klist_time(timestamp):
+    return time.strftime("%m/%d/%Y %H:%M:%S", time.localtime(timestamp))
+
+
+def write_ticket(ccache, end):
+    with open(ccache, "w") as f:
+        f.write(str(int(end)))
+
+
+class FakeKinit(object):
+    """Fake klist/kinit commands backed by files in the ccache directory."""
+
+    def __init__(self, default_ccache_end=None, granted_lifetime=None):
+        self.default_ccache_end = default_ccache_end
+        self.granted_lifetime = granted_lifetime
+        self.kinit_calls = []
+
+    def ticket_end(self, cmd):
+        if "-c" not in cmd:
+            return self.default_ccache_end
+        try:
+            with open(cmd[cmd.index("-c") + 1]) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return None
+
+    def __call__(self, cmd, **kwargs):
+        ret = mock.MagicMock(returncode=0, stdout=b"", stderr=b"")
+        if cmd[0] == "klist":
+            end = self.ticket_end(cmd)
+            if end is None or ("-s" in cmd and end <= time.time()):
+                ret.returncode = 1
+            elif "-s" not in cmd:
+                ret.stdout = (
+                    KLIST_OUTPUT
+                    % (
+                        cmd[-1],
+                        klist_time(end - 3600),
+                        klist_time(end),
+                        klist_time(end),
+                    )
+                ).encode("utf-8")
+        elif cmd[0] == "kinit":
+            self.kinit_calls.append(cmd)
+            lifetime = self.granted_lifetime or int(cmd[cmd.index("-l") + 1][:-1])
+            write_ticket(cmd[cmd.index("-c") + 1], time.time() + lifetime)
+        return ret
+
+
+@pytest.fixture
+def fake_kerberos():
+    with mock.patch("pubtools.iib.auth.kerberos") as kerberos:
+        kerberos.authGSSClientInit.return_value = (1, "context")
+        kerberos.authGSSClientResponse.return_value = "token"
+        kerberos.KrbError = type("KrbError", (Exception,), {})
+        yield kerberos
+
+
+@pytest.fixture
+def fake_kinit():
+    fake = FakeKinit()
+    with mock.patch("subprocess.run", side_effect=fake):
+        yield fake
+
+
+def test_get_shared_instance(tmp_path):
+    auth = CachedKrbAuth.get("user@REALM", "iib-server", ccache_dir=str(tmp_path))
+
+    assert (
+        CachedKrbAuth.get("user@REALM", "iib-server", ccache_dir=str(tmp_path)) is auth
+    )
+    assert (
+        CachedKrbAuth.get("other@REALM", "iib-server", ccache_dir=str(tmp_path))
+        is not auth
+    )
+
+
+def test_ccache_reused(tmp_path, fake_kinit, fake_kerberos):
+    auth = CachedKrbAuth("user@REALM", "iib-server", "user.keytab", str(tmp_path))
+    iib_session = mock.MagicMock()
+    iib_session.session.headers = {}
+
+    auth.make_auth(iib_session)
+    auth.make_auth(iib_session)
+
+    assert iib_session.session.headers["Authorization"] == "Negotiate token"
+    assert fake_kinit.kinit_calls == [
+        [
+            "kinit",
+            "user@REALM",
+            "-k",
+            "-l",
+            "28800s",
+            "-t",
+            "user.keytab",
+            "-c",
+            auth.ccache,
+        ]
+    ]
+    assert oct(os.stat(auth.ccache).st_mode & 0o777) == "0o600"
+    fake_kerberos.authGSSClientInit.assert_called_once_with("HTTP@iib-server")
+
+    # another invocation with the same principal and keytab reuses the ticket
+    other = CachedKrbAuth("user@REALM", "iib-server", "user.keytab", str(tmp_path))
+    assert other.ccache == auth.ccache
+    other.make_auth(iib_session)
+    assert len(fake_kinit.kinit_calls) == 1
+
+
+def test_ccache_near_expiry(tmp_path, fake_kinit, fake_kerberos):
+    auth = CachedKrbAuth("user@REALM", "iib-server", "user.keytab", str(tmp_path))
+    auth._krb_auth_header()
+
+    write_ticket(auth.ccache, time.time() + 60)
+    auth._auth_header = None
+    auth._krb_auth_header()
+
+    assert len(fake_kinit.kinit_calls) == 2
+
+
+def test_ccache_shorter_lifetime(tmp_path, fake_kinit, fake_kerberos):
+    # KDC grants tickets for less than requested
+    fake_kinit.granted_lifetime = 3600
+    auth = CachedKrbAuth("user@REALM", "iib-server", "user.keytab", str(tmp_path))
+    auth._krb_auth_header()
+
+    expires = time.time() + 3600 - auth.renew_margin
+    assert expires - 5 <= auth._auth_header_expires <= expires + 1
+
+    # ticket is renewed once it gets close to its real end time
+    with mock.patch("time.time", return_value=expires + 1):
+        auth._krb_auth_header()
+    assert len(fake_kinit.kinit_calls) == 2
+
+
+def test_default_ccache(tmp_path, fake_kerberos):
+    fake = FakeKinit(default_ccache_end=time.time() + 3600)
+    with mock.patch("subprocess.run", side_effect=fake), mock.patch.dict(
+        os.environ, {"KRB5CCNAME": "FILE:/tmp/user-ccache"}
+    ):
+        auth = CachedKrbAuth("user@REALM", "iib-server", ccache_dir=str(tmp_path))
+        assert auth._krb_auth_header() == "Negotiate token"
+        assert os.environ["KRB5CCNAME"] == "FILE:/tmp/user-ccache"
+
+    assert fake.kinit_calls == []
+    assert auth._auth_header_expires == pytest.approx(
+        fake.default_ccache_end - auth.renew_margin, abs=1
+    )
+
+
+def test_negotiation_failure_renews_ticket(tmp_path, fake_kinit, fake_kerberos):
+    fake_kerberos.authGSSClientStep.side_effect = [fake_kerberos.KrbError(), None]
+    auth = CachedKrbAuth("user@REALM", "iib-server", "user.keytab", str(tmp_path))
+
+    assert auth._krb_auth_header() == "Negotiate token"
+    assert len(fake_kinit.kinit_calls) == 2
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "10/18/26 10:00:00  10/18/26 18:00:00  krbtgt/REALM@REALM",
+        "10/18/2026 10:00:00  10/18/2026 18:00:00  krbtgt/REALM@REALM",
+        "Oct 18 10:00:00 2026  Oct 18 18:00:00 2026  krbtgt/REALM@REALM",
+    ],
+)
+def test_ticket_end_time(line):
+    output = "Ticket cache: FILE:/tmp/krb5cc\n\n%s\n" % line
+    expected = time.mktime((2026, 10, 18, 18, 0, 0, 0, 0, -1))
+
+    assert ticket_end_time(output) == expected
+
+
+def test_ticket_end_time_unknown_output(tmp_path, fake_kinit, fake_kerberos):
+    assert ticket_end_time("klist: No credentials cache found") is None
+
+    auth = CachedKrbAuth("user@REALM", "iib-server", "user.keytab", str(tmp_path))
+    with mock.patch("pubtools.iib.auth.ticket_end_time", return_value=None):
+        auth._krb_auth_header()
+        auth._auth_header = None
+        auth._krb_auth_header()
+
+    # valid ticket is trusted for a while
+    assert len(fake_kinit.kinit_calls) == 1
+    assert auth._auth_header_expires > time.time()
@@ -0,0 +1,95 @@
+import mock
+import pytest
+
+from pubtools.iib.batch import batch_request_data, submit_batch
+from pubtools.iib.engine import IIBOperation
+
+from utils import FakeTaskManager
+
+
+def test_batch_request_data_add():
+    operation = IIBOperation(
+        "add_bundles",
+        "index-1",
+        {
+            "bundles": ["bundle1"],
+            "arches": ["x86_64"],
+            "binary_image": "binary",
+            "check_related_images": None,
+            "overwrite_from_index": True,
+            "overwrite_from_index_token": "token",
+        },
+    )
+
+    assert batch_request_data(operation) == {
+        "from_index": "index-1",
+        "bundles": ["bundle1"],
+        "add_arches": ["x86_64"],
+        "binary_image": "binary",
+        "deprecation_list": [],
+        "overwrite_from_index": True,
+        "overwrite_from_index_token": "token",
+    }
+
+
+def test_batch_request_data_rm():
+    operation = IIBOperation(
+        "remove_operators",
+        "index-1",
+        {"operators": ["operator-1"], "arches": None, "build_tags": ["tag"]},
+        "DELETED",
+    )
+
+    assert batch_request_data(operation) == {
+        "from_index": "index-1",
+        "operators": ["operator-1"],
+        "add_arches": None,
+        "build_tags": ["tag"],
+    }
+
+
+def test_batch_request_data_invalid():
+    with pytest.raises(ValueError, match="cannot be submitted in a batch"):
+        batch_request_data(IIBOperation("add_deprecations", "index-1", {}))
+    with pytest.raises(ValueError, match="Either both or neither"):
+        batch_request_data(
+            IIBOperation("add_bundles", "index-1", {"overwrite_from_index": True})
+        )
+
+
+def test_submit_batch():
+    fake_tm = FakeTaskManager()
+    iib_client = mock.MagicMock(name="IIBClient")
+    iib_client.iib_session.post.return_value.json.return_value = [
+        fake_tm.setup_task("index-1", bundles=["bundle1"]),
+        fake_tm.setup_task("index-2", operators=["operator-1"], op_type="rm"),
+    ]
+    operations = [
+        IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]}),
+        IIBOperation("remove_operators", "index-2", {"operators": ["operator-1"]}),
+    ]
+
+    builds = submit_batch(iib_client, operations, annotations={"release": "1"})
+
+    assert [b.id for b in builds] == ["task-0", "task-1"]
+    assert [b.request_type for b in builds] == ["add", "rm"]
+    iib_client.iib_session.post.assert_called_once_with(
+        "builds/add-rm-batch",
+        json={
+            "build_requests": [
+                {
+                    "from_index": "index-1",
+                    "bundles": ["bundle1"],
+                    "add_arches": None,
+                    "deprecation_list": [],
+                },
+                {
+                    "from_index": "index-2",
+                    "operators": ["operator-1"],
+                    "add_arches": None,
+                },
+            ],
+            "annotations": {"release": "1"},
+        },
+    )
+    iib_client._check_response.assert_called_once()
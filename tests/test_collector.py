@@ -0,0 +1,72 @@
+from concurrent.futures import Future
+
+import pytest
+
+from pubtools.iib.collector import BufferedCollector
+
+from utils import FakeCollector
+
+
+def make_item(src, state):
+    return {"state": state, "origin": "index", "src": src, "filename": "operator"}
+
+
+def test_coalesce_state_changes():
+    backend = FakeCollector()
+
+    with BufferedCollector(backend, flush_interval=60) as collector:
+        collector.update_push_items([make_item("bundle1", "PENDING")])
+        collector.update_push_items([make_item("bundle2", "PENDING")])
+        collector.update_push_items([make_item("bundle1", "PUSHED")])
+
+    assert backend.items == [
+        make_item("bundle1", "PUSHED"),
+        make_item("bundle2", "PENDING"),
+    ]
+
+
+def test_batches():
+    batches = []
+
+    class Backend(object):
+        def update_push_items(self, items):
+            batches.append(items)
+
+    collector = BufferedCollector(Backend(), batch_size=2, flush_interval=60)
+    collector.update_push_items([make_item("bundle%d" % i, "PUSHED") for i in range(5)])
+    collector.close()
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [item["src"] for batch in batches for item in batch] == [
+        "bundle%d" % i for i in range(5)
+    ]
+
+
+def test_flush_sends_queued_items():
+    backend = FakeCollector()
+    collector = BufferedCollector(backend, flush_interval=60)
+
+    collector.update_push_items([make_item("bundle1", "PENDING")])
+    collector.flush()
+    assert backend.items == [make_item("bundle1", "PENDING")]
+
+    # items already sent are not coalesced with later updates
+    collector.update_push_items([make_item("bundle1", "PUSHED")])
+    collector.close()
+    assert [item["state"] for item in backend.items] == ["PENDING", "PUSHED"]
+
+
+def test_collector_error_raised_on_close():
+    class Backend(object):
+        def update_push_items(self, items):
+            future = Future()
+            future.set_exception(ValueError("invalid push item"))
+            return future
+
+    collector = BufferedCollector(Backend(), flush_interval=0)
+    collector.update_push_items([make_item("bundle1", "PUSHED")])
+
+    with pytest.raises(ValueError, match="invalid push item"):
+        collector.close()
+    with pytest.raises(RuntimeError):
+        collector.update_push_items([make_item("bundle1", "PUSHED")])
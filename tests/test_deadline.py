@@ -0,0 +1,37 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pubtools.iib.deadline import Deadline
+
+
+@pytest.mark.parametrize(
+    "value,seconds",
+    [("3600", 3600), ("+90m", 5400), ("1h30m", 5400), ("45s", 45), ("0.5h", 1800)],
+)
+def test_parse_relative(value, seconds):
+    deadline = Deadline.parse(value)
+
+    assert seconds - 1 <= deadline.remaining() <= seconds
+
+
+def test_parse_absolute():
+    at = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    deadline = Deadline.parse(at.isoformat())
+
+    assert 3590 <= deadline.remaining() <= 3600
+    assert not deadline.expired
+
+
+def test_parse_invalid():
+    with pytest.raises(ValueError, match="Invalid deadline"):
+        Deadline.parse("tomorrow")
+
+
+def test_expired():
+    deadline = Deadline(time.monotonic() - 1)
+
+    assert deadline.expired
+    assert deadline.remaining() == 0
@@ -0,0 +1,439 @@
+import mock
+import pytest
+
+from iiblib.iib_build_details_model import IIBBuildDetailsModel
+from iiblib.iib_client import IIBException
+
+from pubtools.iib.engine import (
+    IIBOperation,
+    IIBOperationEngine,
+    coalesce_operations,
+    filter_push_items,
+)
+from pubtools.iib.poller import BuildPoller
+from pubtools.iib.journal import BuildJournal, request_fingerprint
+from pubtools.iib.retry import RetryPolicy
+
+from utils import FakeCollector
+
+
+def test_invalid_operation():
+    with pytest.raises(ValueError):
+        IIBOperation("invalid-op", "index-image")
+
+
+def test_engine_run(fake_iib_client):
+    collector = FakeCollector()
+    completed = []
+    engine = IIBOperationEngine(
+        fake_iib_client, collector, on_complete=completed.append
+    )
+    operations = [
+        IIBOperation(
+            "add_bundles", "index-1", {"bundles": ["bundle1"], "arches": ["arch"]}
+        ),
+        IIBOperation(
+            "remove_operators",
+            "index-2",
+            {"operators": ["operator-1"], "arches": ["arch"]},
+            "DELETED",
+        ),
+    ]
+
+    results = engine.run(operations)
+
+    assert [r.operation for r in results] == operations
+    assert [r.build_details.from_index for r in results] == ["index-1", "index-2"]
+    assert not any(r.failed for r in results)
+    assert sorted(r.operation.index_image for r in completed) == [
+        "index-1",
+        "index-2",
+    ]
+
+    # both builds are submitted before any of them is finished
+    assert [i["state"] for i in collector.items[:2]] == ["PENDING", "PENDING"]
+    assert sorted(i["state"] for i in collector.items[2:]) == ["DELETED", "PUSHED"]
+    assert results[1].push_items == [
+        {
+            "state": "DELETED",
+            "origin": "index-2",
+            "src": None,
+            "filename": "operator-1",
+            "dest": "redhat-operator-index",
+            "build": "feed.com/index/image:tag",
+            "signing_key": None,
+            "checksums": None,
+        }
+    ]
+
+
+def test_engine_failed_build(fake_iib_client, fake_tm):
+    fake_iib_client.add_bundles.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, **dict(kwargs, state_seq=("in_progress", "failed")))
+        )
+    )
+    collector = FakeCollector()
+    engine = IIBOperationEngine(fake_iib_client, collector)
+
+    (result,) = engine.run(
+        [IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"], "arches": None})]
+    )
+
+    assert result.failed
+    assert [i["state"] for i in collector.items] == ["PENDING", "NOTPUSHED"]
+
+
+def test_engine_final_push_items_from_final_build(fake_iib_client, fake_tm):
+    def remove_operators(*args, **kwargs):
+        task = fake_tm.setup_task(*args, **dict(kwargs, op_type="rm"))
+        task["index_image"] = None
+        return IIBBuildDetailsModel.from_dict(task)
+
+    def get_build(build_id):
+        # IIB sets index_image only once the build completes
+        task = fake_tm.get_task(build_id)
+        if task["state"] == "complete":
+            task["index_image"] = "registry/iib-build:%s" % build_id
+        return IIBBuildDetailsModel.from_dict(task)
+
+    fake_iib_client.remove_operators.side_effect = remove_operators
+    fake_iib_client.get_build.side_effect = get_build
+    collector = FakeCollector()
+    engine = IIBOperationEngine(fake_iib_client, collector)
+
+    (result,) = engine.run(
+        [
+            IIBOperation(
+                "remove_operators", "index-1", {"operators": ["operator-1"]}, "DELETED"
+            )
+        ]
+    )
+
+    assert [(i["state"], i["build"]) for i in collector.items] == [
+        ("PENDING", None),
+        ("DELETED", "registry/iib-build:task-0"),
+    ]
+    assert collector.items[1:] == result.push_items
+
+
+def test_engine_no_operations(fake_iib_client):
+    engine = IIBOperationEngine(fake_iib_client, FakeCollector())
+    assert engine.run([]) == []
+    fake_iib_client.get_build.assert_not_called()
+
+
+def test_coalesce_operations():
+    add_1 = IIBOperation(
+        "add_bundles",
+        "index-1",
+        {"bundles": ["bundle1"], "arches": ["arch"], "deprecation_list": ["old1"]},
+    )
+    add_2 = IIBOperation(
+        "add_bundles",
+        "index-1",
+        {"bundles": ["bundle2", "bundle1"], "arches": ["arch"]},
+    )
+    other_index = IIBOperation(
+        "add_bundles", "index-2", {"bundles": ["bundle3"], "arches": ["arch"]}
+    )
+    other_arches = IIBOperation(
+        "add_bundles", "index-1", {"bundles": ["bundle4"], "arches": ["arch2"]}
+    )
+    rm = IIBOperation("remove_operators", "index-1", {"operators": ["op"]})
+
+    groups = coalesce_operations([add_1, other_index, add_2, other_arches, rm])
+
+    assert [originals for _, originals in groups] == [
+        [add_1, add_2],
+        [other_index],
+        [other_arches],
+        [rm],
+    ]
+    merged = groups[0][0]
+    assert merged.index_image == "index-1"
+    assert merged.op_args == {
+        "bundles": ["bundle1", "bundle2"],
+        "arches": ["arch"],
+        "deprecation_list": ["old1"],
+    }
+    assert groups[1][0] is other_index
+
+
+def test_filter_push_items():
+    items = [{"src": "bundle1"}, {"src": "bundle2"}]
+
+    assert filter_push_items(items, ["bundle2"]) == [{"src": "bundle2"}]
+    assert filter_push_items(items, None) == items
+
+
+def test_engine_coalesce(fake_iib_client):
+    collector = FakeCollector()
+    engine = IIBOperationEngine(fake_iib_client, collector, coalesce=True)
+    operations = [
+        IIBOperation("add_bundles", "index-1", {"bundles": [bundle], "arches": None})
+        for bundle in ("bundle1", "bundle2")
+    ]
+
+    results = engine.run(operations)
+
+    fake_iib_client.add_bundles.assert_called_once_with(
+        "index-1", bundles=["bundle1", "bundle2"], arches=None
+    )
+    assert results[0].build_details is results[1].build_details
+    assert [i["src"] for i in results[0].push_items] == ["bundle1"]
+    assert [i["src"] for i in results[1].push_items] == ["bundle2"]
+    assert [(i["state"], i["src"]) for i in collector.items] == [
+        ("PENDING", "bundle1"),
+        ("PENDING", "bundle2"),
+        ("PUSHED", "bundle1"),
+        ("PUSHED", "bundle2"),
+    ]
+
+
+def test_engine_resume_from_journal(fake_iib_client, fake_tm, tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    operation = IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})
+    build = fake_iib_client.add_bundles("index-1", bundles=["bundle1"])
+    journal.record(request_fingerprint(operation), build.id, build.state)
+    fake_iib_client.add_bundles.reset_mock()
+
+    engine = IIBOperationEngine(
+        fake_iib_client, FakeCollector(), journal=journal, resume=True
+    )
+    results = engine.run([operation])
+
+    fake_iib_client.add_bundles.assert_not_called()
+    # build finished in the meantime and is not polled again
+    fake_iib_client.get_build.assert_called_once_with(build.id)
+    assert results[0].build_details.id == build.id
+    assert results[0].build_details.state == "complete"
+    assert journal.find_in_flight(request_fingerprint(operation)) is None
+
+
+def test_engine_attach_build_id(fake_iib_client, fake_tm):
+    build = fake_iib_client.add_bundles("index-1", bundles=["bundle1"])
+    fake_iib_client.add_bundles.reset_mock()
+    operation = IIBOperation(
+        "add_bundles", "index-1", {"bundles": ["bundle1"]}, build_id=build.id
+    )
+
+    results = IIBOperationEngine(fake_iib_client, FakeCollector()).run([operation])
+
+    fake_iib_client.add_bundles.assert_not_called()
+    fake_iib_client.get_build.assert_called_once_with(build.id)
+    assert results[0].build_details.id == build.id
+    assert not results[0].failed
+
+
+def test_engine_cached_build(fake_iib_client, tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    operation = IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})
+    IIBOperationEngine(fake_iib_client, FakeCollector(), journal=journal).run(
+        [operation]
+    )
+    fake_iib_client.add_bundles.reset_mock()
+
+    collector = FakeCollector()
+    engine = IIBOperationEngine(
+        fake_iib_client, collector, journal=journal, cache_ttl=60
+    )
+    results = engine.run(
+        [IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})]
+    )
+
+    fake_iib_client.add_bundles.assert_not_called()
+    assert results[0].build_details.id == "task-0"
+    assert [i["state"] for i in collector.items] == ["PUSHED"]
+
+
+def test_engine_cached_build_outdated(fake_iib_client, tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    operation = IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})
+    engine = IIBOperationEngine(
+        fake_iib_client,
+        FakeCollector(),
+        journal=journal,
+        cache_ttl=60,
+        verify_cache=True,
+    )
+    engine.run([operation])
+    # index was rebuilt by another request since
+    fake_iib_client.iib_session.get.return_value.json.return_value = {
+        "items": [{"id": "task-99", "state": "complete"}]
+    }
+
+    results = engine.run([operation])
+
+    assert fake_iib_client.add_bundles.call_count == 2
+    assert results[0].build_details.id == "task-1"
+    fake_iib_client.iib_session.get.assert_called_once_with(
+        "builds",
+        params={
+            "from_index": "index-1",
+            "state": "complete",
+            "verbose": True,
+            "per_page": 1,
+            "page": 1,
+        },
+    )
+
+
+def test_engine_cancel_on_timeout(fake_iib_client, fake_tm):
+    fake_iib_client.add_bundles.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, state_seq=["in_progress"] * 10, **kwargs)
+        )
+    )
+    collector = FakeCollector()
+    engine = IIBOperationEngine(
+        fake_iib_client,
+        collector,
+        poller=BuildPoller(fake_iib_client, poll_interval=0, timeout=0),
+    )
+
+    with pytest.raises(IIBException, match="Timeout reached"):
+        engine.run(
+            [
+                IIBOperation("add_bundles", index, {"bundles": ["bundle1"]})
+                for index in ("index-1", "index-2")
+            ]
+        )
+
+    assert sorted(c.args[0] for c in fake_iib_client.iib_session.post.mock_calls) == [
+        "builds/task-0/cancel",
+        "builds/task-1/cancel",
+    ]
+    assert [i["state"] for i in collector.items] == [
+        "PENDING",
+        "PENDING",
+        "NOTPUSHED",
+        "NOTPUSHED",
+    ]
+
+
+def test_engine_cancel_on_interrupt(fake_iib_client):
+    collector = FakeCollector()
+    poller = mock.MagicMock(name="BuildPoller")
+    poller.run.side_effect = KeyboardInterrupt
+    engine = IIBOperationEngine(fake_iib_client, collector, poller=poller)
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.run([IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})])
+
+    fake_iib_client.iib_session.post.assert_called_once_with("builds/task-0/cancel")
+    poller.unwatch.assert_called_once_with("task-0")
+    assert [i["state"] for i in collector.items] == ["PENDING", "NOTPUSHED"]
+
+
+def test_engine_resubmit_transient_failure(fake_iib_client, fake_tm):
+    def add_bundles(*args, **kwargs):
+        # first build fails on a registry timeout, the second one succeeds
+        state_seq = ("in_progress", "failed") if not fake_tm.tasks else None
+        task = fake_tm.setup_task(
+            *args, **dict(kwargs, state_seq=state_seq or ("in_progress", "complete"))
+        )
+        task["state_reason"] = "Failed to pull image: i/o timeout"
+        return IIBBuildDetailsModel.from_dict(task)
+
+    fake_iib_client.add_bundles.side_effect = add_bundles
+    collector = FakeCollector()
+    engine = IIBOperationEngine(
+        fake_iib_client,
+        collector,
+        poller=BuildPoller(fake_iib_client, poll_interval=0),
+        retry_policy=RetryPolicy(resubmit_attempts=1),
+    )
+
+    (result,) = engine.run(
+        [IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})]
+    )
+
+    assert not result.failed
+    assert result.build_details.id == "task-1"
+    assert fake_iib_client.add_bundles.call_count == 2
+    assert [i["state"] for i in collector.items] == ["PENDING", "PUSHED"]
+
+
+def test_engine_no_resubmit_of_permanent_failure(fake_iib_client, fake_tm):
+    fake_iib_client.add_bundles.side_effect = (
+        lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+            fake_tm.setup_task(*args, **dict(kwargs, state_seq=("failed", "failed")))
+        )
+    )
+    engine = IIBOperationEngine(
+        fake_iib_client,
+        FakeCollector(),
+        poller=BuildPoller(fake_iib_client, poll_interval=0),
+        retry_policy=RetryPolicy(resubmit_attempts=3),
+    )
+
+    (result,) = engine.run(
+        [IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})]
+    )
+
+    assert result.failed
+    assert fake_iib_client.add_bundles.call_count == 1
+
+
+def test_engine_submit_batches(fake_iib_client, fake_tm):
+    def post(endpoint, json):
+        assert endpoint == "builds/add-rm-batch"
+        resp = mock.Mock()
+        resp.json.return_value = [
+            fake_tm.setup_task(
+                request["from_index"], bundles=request.get("bundles"), arches=None
+            )
+            for request in json["build_requests"]
+        ]
+        return resp
+
+    fake_iib_client.iib_session.post.side_effect = post
+    collector = FakeCollector()
+    engine = IIBOperationEngine(
+        fake_iib_client,
+        collector,
+        poller=BuildPoller(fake_iib_client, poll_interval=0),
+        batch_size=2,
+    )
+    operations = [
+        IIBOperation("add_bundles", index, {"bundles": ["bundle1"], "arches": None})
+        for index in ("index-1", "index-2", "index-3")
+    ]
+
+    results = engine.run(operations)
+
+    assert [r.build_details.from_index for r in results] == [
+        "index-1",
+        "index-2",
+        "index-3",
+    ]
+    assert not any(r.failed for r in results)
+    assert [
+        len(c.kwargs["json"]["build_requests"])
+        for c in fake_iib_client.iib_session.post.call_args_list
+    ] == [2, 1]
+    fake_iib_client.add_bundles.assert_not_called()
+    assert [i["state"] for i in collector.items] == ["PENDING"] * 3 + ["PUSHED"] * 3
+
+
+def test_engine_cached_build_not_recorded_again(fake_iib_client, tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    operation = IIBOperation("add_bundles", "index-1", {"bundles": ["bundle1"]})
+    with mock.patch("time.time", return_value=1000):
+        IIBOperationEngine(fake_iib_client, FakeCollector(), journal=journal).run(
+            [operation]
+        )
+
+    with mock.patch("time.time", return_value=1050):
+        engine = IIBOperationEngine(
+            fake_iib_client, FakeCollector(), journal=journal, cache_ttl=60
+        )
+        with mock.patch.object(journal, "record", wraps=journal.record) as record:
+            (result,) = engine.run([operation])
+
+    assert result.build_details.id == "task-0"
+    record.assert_not_called()
+    # age of the cached build still counts from its completion
+    with mock.patch("time.time", return_value=1070):
+        assert journal.find_completed(request_fingerprint(operation), 60) is None
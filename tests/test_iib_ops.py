@@ -5,14 +5,17 @@ import pkg_resources
 import pytest
 import os
 
+from pubtools.iib.errors import IIBOperationError
 from pubtools.iib.utils import setup_entry_point_cli
 from pubtools.iib.iib_ops import _iib_op_main, print_error_message
 
 import pushcollector
+import requests
 import requests_mock
 
 
 from iiblib.iib_build_details_model import IIBBuildDetailsModel
+from iiblib.iib_client import IIBException
 from more_executors.futures import f_return
 
 from utils import FakeTaskManager, FakeCollector
@@ -91,7 +94,9 @@ def fixture_iib_client():
                 fake_tm.setup_task(*args, **dict(list(kwargs.items())+ [("op_type", "add-deprecations")]))
             )
         )
-        iibc_patched.return_value.get_build.side_effect = fake_tm.get_task
+        iibc_patched.return_value.get_build.side_effect = (
+            lambda build_id: IIBBuildDetailsModel.from_dict(fake_tm.get_task(build_id))
+        )
         iibc_patched.return_value.wait_for_build.side_effect = (
             lambda build_details: IIBBuildDetailsModel.from_dict(
                 fake_tm.get_task(build_details.id)
@@ -112,7 +117,7 @@ def fixture_pushcollector():
 
 @pytest.fixture
 def fixture_iib_krb_auth():
-    with mock.patch("iiblib.iib_authentication.IIBKrbAuth") as iib_krbauth_patched:
+    with mock.patch("pubtools.iib.auth.CachedKrbAuth.get") as iib_krbauth_patched:
         iib_krbauth_patched.return_value = mock.MagicMock(name="MockedIIBKrbAuth")
         yield iib_krbauth_patched
 
@@ -340,8 +345,12 @@ def test_add_bundles_cli_error(
     ]
 
     mock_print_error_message.assert_called_once_with(
-        "https://iib-server/api/v1/builds/task-4"
+        "https://iib-server/api/v1/builds/task-4",
+        fixture_iib_client.return_value.iib_session,
+        mock.ANY,
     )
+    assert mock_print_error_message.call_args[0][2].id == "task-4"
+    assert mock_print_error_message.call_args[0][2].state == "failed"
 
 
 def test_add_bundles_py(
@@ -505,8 +514,12 @@ def test_remove_operators_cli_error(
     ]
 
     mock_print_error_message.assert_called_once_with(
-        "https://iib-server/api/v1/builds/task-8"
+        "https://iib-server/api/v1/builds/task-8",
+        fixture_iib_client.return_value.iib_session,
+        mock.ANY,
     )
+    assert mock_print_error_message.call_args[0][2].id == "task-8"
+    assert mock_print_error_message.call_args[0][2].state == "failed"
 
 
 def test_remove_operators_py(
@@ -598,8 +611,12 @@ def test_add_deprecations_cli_error(
     ]
 
     mock_print_error_message.assert_called_once_with(
-        "https://iib-server/api/v1/builds/task-11"
+        "https://iib-server/api/v1/builds/task-11",
+        fixture_iib_client.return_value.iib_session,
+        mock.ANY,
     )
+    assert mock_print_error_message.call_args[0][2].id == "task-11"
+    assert mock_print_error_message.call_args[0][2].state == "failed"
 
 
 def test_add_deprecations_py(
@@ -652,3 +669,232 @@ def test_print_error_message(caplog):
 
         assert len(m.request_history) == 1
         assert m.request_history[0].url == "https://iib-test.com/api/v1/builds/5"
+
+
+def test_print_error_message_session(caplog):
+    caplog.set_level(logging.INFO)
+    iib_session = mock.MagicMock(verify=False)
+    iib_session.session.get.return_value.json.return_value = {
+        "state_reason": "Generic IIB error"
+    }
+
+    print_error_message("https://iib-test.com/api/v1/builds/5", iib_session)
+
+    iib_session.session.get.assert_called_once_with(
+        "https://iib-test.com/api/v1/builds/5", verify=False
+    )
+    assert (
+        caplog.records[0].message == "IIB Failed with the error: 'Generic IIB error'"
+    )
+
+
+def test_print_error_message_build_details(caplog):
+    caplog.set_level(logging.INFO)
+    iib_session = mock.MagicMock()
+    build_details = mock.MagicMock(
+        state_reason="Failed to push the index image",
+        logs={"url": "https://iib-test.com/api/v1/builds/5/logs", "expiration": ""},
+    )
+
+    print_error_message(
+        "https://iib-test.com/api/v1/builds/5", iib_session, build_details
+    )
+
+    iib_session.session.get.assert_not_called()
+    assert [r.message for r in caplog.records] == [
+        "IIB Failed with the error: 'Failed to push the index image'",
+        "Please check the full logs at https://iib-test.com/api/v1/builds/5/logs",
+    ]
+
+
+def test_print_error_message_missing_state_reason(caplog):
+    caplog.set_level(logging.INFO)
+    iib_session = mock.MagicMock(verify=True)
+    iib_session.session.get.return_value.json.return_value = {
+        "state_reason": "Generic IIB error"
+    }
+    build_details = mock.MagicMock(state_reason=None, logs={})
+
+    print_error_message(
+        "https://iib-test.com/api/v1/builds/5", iib_session, build_details
+    )
+
+    iib_session.session.get.assert_called_once_with(
+        "https://iib-test.com/api/v1/builds/5", verify=True
+    )
+    assert (
+        caplog.records[0].message == "IIB Failed with the error: 'Generic IIB error'"
+    )
+
+
+def test_add_bundles_multiple_indices(
+    tmp_path,
+    fixture_iib_client,
+    fixture_iib_krb_auth,
+    fixture_common_iib_op_args,
+    fixture_pushcollector,
+):
+    index_file = tmp_path / "indices"
+    index_file.write_text("# comment\nindex-image-2\n\nindex-image-3\n")
+
+    with setup_entry_point_py(
+        ("pubtools_iib", "console_scripts", "pubtools-iib-add-bundles"),
+        {
+            "OVERWRITE_FROM_INDEX_TOKEN": "overwrite_from_index_token",
+        },
+    ) as entry_func:
+        retval = entry_func(
+            ["cmd"]
+            + fixture_common_iib_op_args
+            + [
+                "--index-image-file",
+                str(index_file),
+                "--bundle",
+                "bundle1",
+                "--arch",
+                "arch",
+            ]
+        )
+
+    assert len(retval) == 3
+    assert [r.from_index for r in retval] == [
+        "index-image",
+        "index-image-2",
+        "index-image-3",
+    ]
+    fixture_iib_client.assert_called_once()
+    assert fixture_iib_client.return_value.add_bundles.call_count == 3
+    assert fixture_iib_client.return_value.get_build.call_count == 3
+
+    pending = [i for i in fixture_pushcollector.items if i["state"] == "PENDING"]
+    pushed = [i for i in fixture_pushcollector.items if i["state"] == "PUSHED"]
+    assert sorted(i["origin"] for i in pending) == [
+        "index-image",
+        "index-image-2",
+        "index-image-3",
+    ]
+    assert sorted(i["origin"] for i in pushed) == [
+        "index-image",
+        "index-image-2",
+        "index-image-3",
+    ]
+    # all builds are submitted before waiting on any of them
+    assert fixture_pushcollector.items[:3] == pending
+
+
+@mock.patch("pubtools.iib.worker.submit_to_worker")
+def test_add_bundles_worker(
+    mock_submit_to_worker,
+    fixture_iib_client,
+    fixture_common_iib_op_args,
+    fixture_pushcollector,
+):
+    task = fake_tm.setup_task("index-image", bundles=["bundle1"])
+    task["state"] = "complete"
+    mock_submit_to_worker.return_value = {
+        "ok": True,
+        "failed": False,
+        "builds": [task],
+        "push_items": [operator_1_push_item_pending, operator_1_push_item_pushed],
+    }
+
+    with setup_entry_point_py(
+        ("pubtools_iib", "console_scripts", "pubtools-iib-add-bundles"),
+        {},
+    ) as entry_func:
+        retval = entry_func(
+            ["cmd"]
+            + fixture_common_iib_op_args
+            + ["--bundle", "bundle1", "--worker-socket", "/run/iib.sock"]
+        )
+
+    assert retval == IIBBuildDetailsModel.from_dict(task)
+    assert fixture_pushcollector.items == [
+        operator_1_push_item_pending,
+        operator_1_push_item_pushed,
+    ]
+    fixture_iib_client.assert_not_called()
+
+    (socket_path, operation, request_args, final_state), _ = (
+        mock_submit_to_worker.call_args
+    )
+    assert (socket_path, operation, final_state) == (
+        "/run/iib.sock",
+        "add_bundles",
+        "PUSHED",
+    )
+    assert request_args["index_image"] == ["index-image"]
+    assert request_args["bundle"] == ["bundle1"]
+    assert "worker_socket" not in request_args
+
+
+@mock.patch("pubtools.iib.worker.submit_to_worker")
+def test_remove_operators_worker_failed(
+    mock_submit_to_worker,
+    fixture_iib_client,
+    fixture_common_iib_op_args,
+    fixture_pushcollector,
+):
+    task = fake_tm.setup_task("index-image", operators=["operator-1"], op_type="rm")
+    task["state"] = "failed"
+    mock_submit_to_worker.return_value = {
+        "ok": True,
+        "failed": True,
+        "builds": [task],
+        "push_items": [
+            operator_1_push_item_delete_pending,
+            operator_1_push_item_delete_notpushed,
+        ],
+    }
+
+    with setup_entry_point_py(
+        ("pubtools_iib", "console_scripts", "pubtools-iib-remove-operators"),
+        {},
+    ) as entry_func:
+        with pytest.raises(SystemExit):
+            entry_func(
+                ["cmd"]
+                + fixture_common_iib_op_args
+                + ["--operator", "operator-1", "--worker-socket", "/run/iib.sock"]
+            )
+
+    assert fixture_pushcollector.items == [
+        operator_1_push_item_delete_pending,
+        operator_1_push_item_delete_notpushed,
+    ]
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        (["--build-timeout", "1", "--poll-min-interval", "0.5"], IIBException),
+        ([], requests.ConnectionError),
+    ],
+)
+def test_add_bundles_py_errors(
+    args,
+    expected,
+    fixture_iib_client,
+    fixture_iib_krb_auth,
+    fixture_common_iib_op_args,
+    fixture_pushcollector,
+):
+    if expected is IIBException:
+        fixture_iib_client.return_value.add_bundles.side_effect = (
+            lambda *args, **kwargs: IIBBuildDetailsModel.from_dict(
+                fake_tm.setup_task(*args, **dict(kwargs, state_seq=["in_progress"] * 10))
+            )
+        )
+    else:
+        fixture_iib_client.return_value.add_bundles.side_effect = expected("down")
+
+    # entry points raise the original errors, not IIBOperationError
+    with setup_entry_point_py(
+        ("pubtools_iib", "console_scripts", "pubtools-iib-add-bundles"),
+        {"OVERWRITE_FROM_INDEX_TOKEN": "overwrite_from_index_token"},
+    ) as entry_func:
+        with pytest.raises(expected) as exc_info:
+            entry_func(
+                ["cmd"] + fixture_common_iib_op_args + ["--bundle", "bundle1"] + args
+            )
+    assert not isinstance(exc_info.value, IIBOperationError)
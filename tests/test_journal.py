@@ -0,0 +1,74 @@
+import mock
+
+from pubtools.iib.engine import IIBOperation
+from pubtools.iib.journal import BuildJournal, request_fingerprint
+
+
+def test_fingerprint_ignores_order_and_token():
+    op1 = IIBOperation(
+        "add_bundles",
+        "index",
+        {
+            "bundles": ["bundle1", "bundle2"],
+            "arches": ["x86_64", "s390x"],
+            "overwrite_from_index_token": "user:pass",
+        },
+    )
+    op2 = IIBOperation(
+        "add_bundles",
+        "index",
+        {"bundles": ["bundle2", "bundle1"], "arches": ["s390x", "x86_64"]},
+    )
+    op3 = IIBOperation("add_bundles", "index", {"bundles": ["bundle1"]})
+
+    assert request_fingerprint(op1) == request_fingerprint(op2)
+    assert request_fingerprint(op1) != request_fingerprint(op3)
+
+
+def test_find_in_flight(tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    journal.record("fp", "task-1", "failed", "NOTPUSHED")
+    journal.record("fp", "task-2", "in_progress", "PENDING")
+    journal.record("other", "task-3", "in_progress", "PENDING")
+
+    assert journal.find_in_flight("fp") == "task-2"
+
+    journal.record("fp", "task-2", "complete", "PUSHED")
+    assert journal.find_in_flight("fp") is None
+    journal.close()
+
+    # records survive reopening
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    assert journal.find_in_flight("other") == "task-3"
+    journal.close()
+
+
+def test_find_completed_and_evict(tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    journal.record("fp", "task-1", "in_progress", "PENDING")
+    assert journal.find_completed("fp", 3600) is None
+
+    journal.record("fp", "task-1", "complete", "PUSHED", {"id": "task-1"})
+    journal.record("fp", "task-2", "failed", "NOTPUSHED", {"id": "task-2"})
+
+    assert journal.find_completed("fp", 3600) == {"id": "task-1"}
+    assert journal.find_completed("fp", -1) is None
+
+    assert journal.evict(-1) == 2
+    assert journal.find_completed("fp", 3600) is None
+    journal.close()
+
+
+def test_completion_time_not_extended(tmp_path):
+    journal = BuildJournal(str(tmp_path / "journal.sqlite"))
+    with mock.patch("time.time", return_value=1000):
+        journal.record("fp", "task-1", "complete", "PUSHED", {"id": "task-1"})
+    # recorded again later, e.g. by an older version on a cache hit
+    with mock.patch("time.time", return_value=2000):
+        journal.record("fp", "task-1", "complete", "PUSHED", {"id": "task-1"})
+
+    with mock.patch("time.time", return_value=2500):
+        assert journal.find_completed("fp", 1600) == {"id": "task-1"}
+        assert journal.find_completed("fp", 1400) is None
+        assert journal.evict(1400) == 1
+    journal.close()
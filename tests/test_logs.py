@@ -0,0 +1,83 @@
+import logging
+
+import mock
+import pytest
+import requests
+
+from pubtools.iib.logs import BuildLogTailer
+
+
+def make_response(status_code, content):
+    resp = mock.MagicMock(status_code=status_code)
+    resp.iter_content.side_effect = lambda chunk_size: [
+        content[i : i + chunk_size] for i in range(0, len(content), chunk_size)
+    ]
+    if status_code >= 400:
+        resp.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return resp
+
+
+def test_tail_incremental(caplog):
+    caplog.set_level(logging.INFO)
+    iib_session = mock.MagicMock()
+    iib_session.get.side_effect = [
+        make_response(200, b"line 1\nline 2\nline"),
+        make_response(206, b" 3\nline 4\n"),
+        make_response(416, b""),
+    ]
+    tailer = BuildLogTailer(iib_session, 5, chunk_size=4)
+
+    assert tailer.tail() == 18
+    assert tailer.tail() == 10
+    assert tailer.tail() == 0
+    tailer.flush()
+
+    assert iib_session.get.call_args_list == [
+        mock.call("builds/5/logs", headers={}, stream=True),
+        mock.call("builds/5/logs", headers={"Range": "bytes=18-"}, stream=True),
+        mock.call("builds/5/logs", headers={"Range": "bytes=28-"}, stream=True),
+    ]
+    assert [r.getMessage() for r in caplog.records] == [
+        "[IIB build 5] line 1",
+        "[IIB build 5] line 2",
+        "[IIB build 5] line 3",
+        "[IIB build 5] line 4",
+    ]
+
+
+def test_tail_range_ignored(caplog):
+    caplog.set_level(logging.INFO)
+    iib_session = mock.MagicMock()
+    iib_session.get.side_effect = [
+        make_response(200, b"line 1\n"),
+        make_response(200, b"line 1\nline 2"),
+    ]
+    tailer = BuildLogTailer(iib_session, 5, chunk_size=3)
+
+    tailer.tail()
+    assert tailer.tail() == 6
+    tailer.flush()
+
+    assert [r.getMessage() for r in caplog.records] == [
+        "[IIB build 5] line 1",
+        "[IIB build 5] line 2",
+    ]
+
+
+def test_tail_logs_not_available():
+    iib_session = mock.MagicMock()
+    iib_session.get.return_value = make_response(404, b"")
+    tailer = BuildLogTailer(iib_session, 5)
+
+    assert tailer.tail() == 0
+    assert tailer.offset == 0
+
+
+def test_tail_error():
+    iib_session = mock.MagicMock()
+    iib_session.get.return_value = make_response(500, b"")
+    tailer = BuildLogTailer(iib_session, 5)
+
+    with pytest.raises(requests.HTTPError):
+        tailer.tail()
+    iib_session.get.return_value.close.assert_called_once()
@@ -0,0 +1,238 @@
+import time
+
+import mock
+import pytest
+import requests
+
+from iiblib.iib_build_details_model import IIBBuildDetailsModel
+from iiblib.iib_client import IIBException
+
+from pubtools.iib.deadline import Deadline
+from pubtools.iib.poller import AdaptiveBackoff, BuildPoller
+
+
+def test_poller_run(fake_iib_client, make_build):
+    poller = BuildPoller(fake_iib_client, poll_interval=0)
+    build_1 = make_build(state_seq=("in_progress", "in_progress", "complete"))
+    build_2 = make_build(state_seq=("in_progress", "failed"))
+    future_1 = poller.watch(build_1)
+    future_2 = poller.watch(build_2)
+
+    finished = list(poller.run())
+
+    assert [b.id for b in finished] == [build_2.id, build_1.id]
+    assert future_1.result().state == "complete"
+    assert future_2.result().state == "failed"
+    assert poller.pending == 0
+    assert fake_iib_client.get_build.call_count == 3
+
+
+def test_poller_watch_twice(fake_iib_client, make_build):
+    poller = BuildPoller(fake_iib_client, poll_interval=0)
+    build = make_build()
+
+    assert poller.watch(build) is poller.watch(build)
+    assert poller.pending == 1
+
+
+def test_poller_batch(fake_tm, fake_iib_client, make_build):
+    build_1 = make_build()
+    build_2 = make_build()
+    build_3 = make_build()
+    fake_tm.tasks[build_2.id]["batch"] = build_1.batch
+    fake_tm.tasks[build_3.id]["batch"] = build_1.batch
+    build_2 = IIBBuildDetailsModel.from_dict(fake_tm.tasks[build_2.id])
+    build_3 = IIBBuildDetailsModel.from_dict(fake_tm.tasks[build_3.id])
+
+    # build_3 is missing from the list response and is fetched directly
+    fake_iib_client.iib_session.get.return_value.json.return_value = {
+        "items": [
+            dict(fake_tm.tasks[build_1.id], state="complete"),
+            dict(fake_tm.tasks[build_2.id], state="complete"),
+        ],
+        "meta": {"page": 1},
+    }
+
+    poller = BuildPoller(fake_iib_client, poll_interval=0)
+    for build in (build_1, build_2, build_3):
+        poller.watch(build)
+
+    finished = poller.poll()
+
+    assert sorted(b.id for b in finished) == sorted(
+        [build_1.id, build_2.id, build_3.id]
+    )
+    fake_iib_client.iib_session.get.assert_called_once_with(
+        "builds",
+        params={"batch": build_1.batch, "verbose": True, "per_page": 100, "page": 1},
+    )
+    fake_iib_client.get_build.assert_called_once_with(build_3.id)
+
+
+def test_poller_batch_pages(fake_tm, fake_iib_client, make_build):
+    builds = [make_build() for __ in range(3)]
+    for build in builds:
+        fake_tm.tasks[build.id]["batch"] = builds[0].batch
+    builds = [IIBBuildDetailsModel.from_dict(fake_tm.tasks[b.id]) for b in builds]
+    other = dict(fake_tm.tasks[builds[0].id], id="task-99")
+    pages = [
+        {"items": [other, fake_tm.tasks[builds[0].id]], "meta": {"next": "page-2"}},
+        {"items": [fake_tm.tasks[builds[1].id]], "meta": {"next": "page-3"}},
+        {"items": [fake_tm.tasks[builds[2].id]], "meta": {"next": None}},
+    ]
+    fake_iib_client.iib_session.get.return_value.json.side_effect = [
+        dict(page, items=[dict(item, state="complete") for item in page["items"]])
+        for page in pages
+    ]
+
+    poller = BuildPoller(fake_iib_client, poll_interval=0)
+    for build in builds[:2]:
+        poller.watch(build)
+
+    finished = poller.poll()
+
+    assert [b.id for b in finished] == [builds[0].id, builds[1].id]
+    # all watched builds were found on the second page, the third is not fetched
+    assert [
+        c.kwargs["params"]["page"]
+        for c in fake_iib_client.iib_session.get.call_args_list
+    ] == [1, 2]
+    fake_iib_client.get_build.assert_not_called()
+
+
+def test_poller_timeout(fake_iib_client, make_build):
+    poller = BuildPoller(fake_iib_client, poll_interval=0, timeout=0)
+    build = make_build(state_seq=("in_progress", "in_progress"))
+    future = poller.watch(build)
+
+    with pytest.raises(IIBException, match="Timeout reached"):
+        list(poller.run())
+
+    assert isinstance(future.exception(), IIBException)
+    assert poller.pending == 0
+
+
+def test_backoff_queued_build(make_build):
+    backoff = AdaptiveBackoff(min_interval=5, max_interval=60, factor=2, jitter=0)
+    build = make_build()
+
+    assert [backoff.interval(build, polls) for polls in range(6)] == [
+        5,
+        10,
+        20,
+        40,
+        60,
+        60,
+    ]
+
+
+def test_backoff_started_build(fake_tm):
+    backoff = AdaptiveBackoff(min_interval=5, max_interval=60, factor=2, jitter=0)
+    fake_tm.setup_task("index-image", bundles=["bundle1"])
+    task = fake_tm.setup_task("index-image", bundles=["bundle1"])
+    task["state_history"] = [
+        {"state": "in_progress", "state_reason": "Building the index image"},
+        {"state": "in_progress", "state_reason": "The request was initiated"},
+    ]
+    build = IIBBuildDetailsModel.from_dict(task)
+
+    assert backoff.started(build)
+    assert backoff.interval(build, 10) == 5
+
+
+def test_backoff_jitter(make_build):
+    backoff = AdaptiveBackoff(min_interval=5, max_interval=60, factor=2, jitter=0.2)
+    build = make_build()
+
+    for _ in range(20):
+        assert 16 <= backoff.interval(build, 2) <= 24
+
+
+def test_backoff_default_started_build(fake_tm):
+    backoff = AdaptiveBackoff()
+    task = fake_tm.setup_task("index-image", bundles=["bundle1"])
+    task["state_history"] = [
+        {"state": "in_progress", "state_reason": "Building the index image"},
+        {"state": "in_progress", "state_reason": "The request was initiated"},
+    ]
+    build = IIBBuildDetailsModel.from_dict(task)
+
+    # never poll running builds more often than IIBClient.wait_for_build
+    for _ in range(20):
+        assert backoff.interval(build, 10) >= 30
+
+
+def test_backoff_invalid_intervals():
+    with pytest.raises(ValueError):
+        AdaptiveBackoff(min_interval=10, max_interval=5)
+
+
+def test_poller_next_interval(fake_iib_client, make_build):
+    backoff = AdaptiveBackoff(min_interval=5, max_interval=60, jitter=0)
+    poller = BuildPoller(fake_iib_client, timeout=3600, backoff=backoff)
+    assert poller.next_interval() == 0
+
+    poller.watch(make_build(state_seq=("in_progress", "in_progress", "complete")))
+    assert poller.next_interval() == 5
+    poller.poll()
+    assert poller.next_interval() == 10
+
+    poller.timeout = 1
+    poller.watch(make_build())
+    assert poller.next_interval() <= 1
+
+
+def test_poller_on_update(fake_iib_client, make_build):
+    updates = []
+    poller = BuildPoller(fake_iib_client, poll_interval=0, on_update=updates.append)
+    build = make_build(state_seq=("in_progress", "in_progress", "complete"))
+    poller.watch(build)
+
+    list(poller.run())
+
+    assert [(b.id, b.state) for b in updates] == [
+        (build.id, "in_progress"),
+        (build.id, "complete"),
+    ]
+
+
+def test_poller_deadline(fake_iib_client, make_build):
+    poller = BuildPoller(
+        fake_iib_client, poll_interval=0, timeout=3600, deadline=Deadline.after(0)
+    )
+    poller.watch(make_build(state_seq=("in_progress", "in_progress")))
+
+    with pytest.raises(IIBException, match="Deadline reached"):
+        list(poller.run())
+
+
+def test_poller_deadline_queued_build_aborted_early(fake_iib_client, make_build):
+    poller = BuildPoller(
+        fake_iib_client, poll_interval=0, deadline=Deadline.after(3600)
+    )
+    # a build of this run already took longer than the remaining budget
+    poller._run_times.append(7200)
+    poller.watch(make_build(state_seq=("in_progress", "in_progress")))
+
+    with pytest.raises(IIBException, match="cannot finish before the deadline"):
+        poller.poll()
+
+
+def test_poller_timeout_while_iib_unreachable(fake_iib_client, make_build):
+    fake_iib_client.get_build.side_effect = requests.ConnectionError("unreachable")
+    poller = BuildPoller(fake_iib_client, poll_interval=0, timeout=60)
+    build = make_build()
+    future = poller.watch(build)
+
+    with pytest.raises(requests.ConnectionError):
+        poller.poll()
+    assert poller.next_interval() == 1
+    with pytest.raises(requests.ConnectionError):
+        poller.poll()
+    assert poller.next_interval() == 2
+
+    with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+        with pytest.raises(IIBException, match="Timeout reached"):
+            poller.poll()
+    assert isinstance(future.exception(), IIBException)
+    assert poller.pending == 0
@@ -0,0 +1,123 @@
+import tracemalloc
+
+import pytest
+
+from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+from pubtools.iib.push_items import (
+    CompactPushItem,
+    iter_compact_push_items,
+    iter_push_items,
+    push_items_from_build,
+    send_push_items,
+)
+
+from utils import FakeTaskManager
+
+
+class CountingCollector(object):
+    def __init__(self):
+        self.chunks = []
+
+    def update_push_items(self, items):
+        self.chunks.append(len(items))
+
+
+@pytest.fixture
+def large_build():
+    """Synthetic build details of an index with 50k bundles."""
+    task = FakeTaskManager().setup_task("index-image", bundles=[])
+    task["bundle_mapping"] = {
+        "operator-%d" % op: ["bundle-%d-%d" % (op, i) for i in range(100)]
+        for op in range(500)
+    }
+    return IIBBuildDetailsModel.from_dict(task)
+
+
+def test_iter_push_items(large_build):
+    items = iter_push_items(large_build, "PENDING")
+
+    assert next(items) == {
+        "state": "PENDING",
+        "origin": "index-image",
+        "src": "bundle-0-0",
+        "filename": "operator-0",
+        "dest": "redhat-operator-index",
+        "build": "feed.com/index/image:tag",
+        "signing_key": None,
+        "checksums": None,
+    }
+    assert sum(1 for _ in items) == 49999
+
+
+def test_send_push_items_chunked(large_build):
+    collector = CountingCollector()
+
+    send_push_items(collector, iter_push_items(large_build, "PUSHED"), chunk_size=1000)
+
+    assert collector.chunks == [1000] * 50
+
+
+def test_send_push_items_memory_50k_bundles(large_build):
+    def peak(func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    chunked = peak(
+        lambda: send_push_items(
+            CountingCollector(), iter_push_items(large_build, "PUSHED"), 1000
+        )
+    )
+    whole = peak(
+        lambda: CountingCollector().update_push_items(
+            push_items_from_build(large_build, "PUSHED")
+        )
+    )
+
+    # only one chunk is alive at a time
+    assert chunked * 10 < whole
+
+
+def test_compact_push_item_with_state(large_build):
+    pending = next(iter_compact_push_items(large_build, "PENDING"))
+
+    pushed = pending.with_state("PUSHED")
+
+    assert pending.state == "PENDING"
+    assert pushed.to_dict() == dict(pending.to_dict(), state="PUSHED")
+    assert pushed._shared is pending._shared
+
+
+def test_send_compact_push_items(large_build):
+    sent = []
+
+    class Collector(object):
+        def update_push_items(self, items):
+            sent.extend(items)
+
+    items = list(iter_compact_push_items(large_build, "PENDING"))[:2]
+    send_push_items(Collector(), [items[0], items[1].to_dict()])
+
+    assert sent == [items[0].to_dict(), items[1].to_dict()]
+    assert all(isinstance(item, CompactPushItem) for item in items)
+
+
+def test_compact_push_items_memory(large_build):
+    def allocated(func):
+        tracemalloc.start()
+        try:
+            ret = func()
+            return tracemalloc.get_traced_memory()[0], ret
+        finally:
+            tracemalloc.stop()
+
+    compact, __ = allocated(
+        lambda: list(iter_compact_push_items(large_build, "PENDING"))
+    )
+    dicts, __ = allocated(lambda: push_items_from_build(large_build, "PENDING"))
+
+    assert compact * 3 < dicts
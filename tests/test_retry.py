@@ -0,0 +1,170 @@
+import mock
+import pytest
+import requests
+import urllib3
+
+from iiblib.iib_build_details_model import IIBBuildDetailsModel
+
+from pubtools.iib.errors import CircuitOpenError
+from pubtools.iib.retry import (
+    CircuitBreaker,
+    RetryPolicy,
+    get_circuit_breaker,
+    is_connect_error,
+    is_transient_error,
+)
+
+from utils import FakeTaskManager
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+def _build(state, state_reason):
+    task = FakeTaskManager().setup_task("index", state_seq=(state,))
+    task["state_reason"] = state_reason
+    return IIBBuildDetailsModel.from_dict(task)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with mock.patch("time.sleep") as sleep:
+        yield sleep
+
+
+def test_is_transient_error():
+    assert is_transient_error(requests.ConnectionError())
+    assert is_transient_error(requests.Timeout())
+    assert is_transient_error(_http_error(503))
+    assert is_transient_error(_http_error(429))
+    assert not is_transient_error(_http_error(400))
+    assert not is_transient_error(ValueError())
+
+
+def test_retry_transient_errors(no_sleep):
+    func = mock.Mock(side_effect=[requests.ConnectionError(), _http_error(502), "ok"])
+    policy = RetryPolicy(attempts=3, backoff_factor=2)
+
+    assert policy.call(func, "arg", key="value") == "ok"
+    assert func.call_args_list == [mock.call("arg", key="value")] * 3
+    assert no_sleep.call_count == 2
+    # exponential backoff with jitter
+    assert 1 <= no_sleep.call_args_list[0].args[0] <= 2
+    assert 2 <= no_sleep.call_args_list[1].args[0] <= 4
+
+
+def test_retry_gives_up():
+    func = mock.Mock(side_effect=requests.ConnectionError("down"))
+
+    with pytest.raises(requests.ConnectionError, match="down"):
+        RetryPolicy(attempts=2).call(func)
+    assert func.call_count == 2
+
+
+def test_no_retry_of_permanent_errors():
+    func = mock.Mock(side_effect=_http_error(400))
+
+    with pytest.raises(requests.HTTPError):
+        RetryPolicy(attempts=3).call(func)
+    assert func.call_count == 1
+
+
+def test_circuit_breaker_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    policy = RetryPolicy(attempts=1, breaker=breaker)
+    func = mock.Mock(side_effect=requests.ConnectionError())
+
+    for __ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            policy.call(func)
+
+    assert breaker.open
+    with pytest.raises(CircuitOpenError):
+        policy.call(func)
+    assert func.call_count == 2
+
+
+def test_circuit_breaker_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    policy = RetryPolicy(attempts=1, breaker=breaker)
+
+    with mock.patch("time.monotonic", return_value=100):
+        with pytest.raises(requests.ConnectionError):
+            policy.call(mock.Mock(side_effect=requests.ConnectionError()))
+
+    with mock.patch("time.monotonic", return_value=161):
+        # trial call fails, circuit opens again
+        with pytest.raises(requests.ConnectionError):
+            policy.call(mock.Mock(side_effect=requests.ConnectionError()))
+        with pytest.raises(CircuitOpenError):
+            policy.call(mock.Mock())
+
+    with mock.patch("time.monotonic", return_value=222):
+        assert policy.call(mock.Mock(return_value="ok")) == "ok"
+    assert not breaker.open
+
+
+def test_get_circuit_breaker_shared():
+    breaker = get_circuit_breaker("iib-server", 3, 30)
+
+    assert get_circuit_breaker("iib-server", 3, 30) is breaker
+    assert get_circuit_breaker("other-server", 3, 30) is not breaker
+
+
+def test_is_transient_build():
+    policy = RetryPolicy(transient_patterns=[r"registry .* unavailable"])
+
+    assert policy.is_transient_build(_build("failed", "Registry quay.io unavailable"))
+    assert not policy.is_transient_build(_build("failed", "Bundle not found"))
+    assert not policy.is_transient_build(
+        _build("complete", "Registry quay.io unavailable")
+    )
+    assert RetryPolicy().is_transient_build(_build("failed", "Request timed out"))
+
+
+def _connect_error():
+    reason = urllib3.exceptions.NewConnectionError(None, "refused")
+    return requests.ConnectionError(urllib3.exceptions.MaxRetryError(None, "/", reason))
+
+
+def test_is_connect_error():
+    assert is_connect_error(_connect_error())
+    assert is_connect_error(requests.ConnectTimeout())
+    assert not is_connect_error(requests.ReadTimeout())
+    assert not is_connect_error(requests.ConnectionError("Connection aborted"))
+    assert not is_connect_error(_http_error(503))
+
+
+def test_submit_retries_only_connect_errors():
+    policy = RetryPolicy(attempts=3)
+    func = mock.Mock(side_effect=[_connect_error(), "build"])
+
+    assert policy.submit(func) == "build"
+    assert func.call_count == 2
+
+    # IIB may have accepted the request already
+    for error in (requests.ReadTimeout(), _http_error(502)):
+        func = mock.Mock(side_effect=[error, "build"])
+        with pytest.raises(type(error)):
+            policy.submit(func)
+        assert func.call_count == 1
+
+
+@pytest.mark.parametrize("error", [_http_error(400), KeyboardInterrupt()])
+def test_circuit_breaker_trial_not_stuck(error):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    policy = RetryPolicy(attempts=1, breaker=breaker)
+
+    with mock.patch("time.monotonic", return_value=100):
+        with pytest.raises(requests.ConnectionError):
+            policy.call(mock.Mock(side_effect=requests.ConnectionError()))
+
+    with mock.patch("time.monotonic", return_value=161):
+        with pytest.raises(type(error)):
+            policy.call(mock.Mock(side_effect=error))
+        # another trial call is let through
+        assert policy.call(mock.Mock(return_value="ok")) == "ok"
+    assert not breaker.open
@@ -0,0 +1,118 @@
+from concurrent.futures import Future
+
+import mock
+import pytest
+
+from pubtools.iib.errors import IIBBuildFailed
+from pubtools.iib.engine import IIBOperation
+from pubtools.iib.scheduler import IndexScheduler
+
+
+class FakeIIBOperations(object):
+    """Starts nothing, lets tests finish submitted operations by hand."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, operation, check=True):
+        future = Future()
+        self.submitted.append((operation, future))
+        return future
+
+    def finish(self, index, output=None, failed=False):
+        operation, future = self.submitted[index]
+        future.set_result(
+            mock.Mock(
+                operation=operation,
+                failed=failed,
+                build_details=mock.Mock(index_image=output),
+            )
+        )
+
+
+def make_op(index, bundle="bundle1", **op_args):
+    return IIBOperation("add_bundles", index, dict(op_args, bundles=[bundle]))
+
+
+def test_same_index_serialized_and_chained():
+    iib_ops = FakeIIBOperations()
+    scheduler = IndexScheduler(iib_ops)
+
+    first = scheduler.schedule(make_op("index-1", "bundle1"))
+    second = scheduler.schedule(make_op("index-1", "bundle2"))
+    other = scheduler.schedule(make_op("index-2"))
+
+    assert [op.index_image for op, __ in iib_ops.submitted] == ["index-1", "index-2"]
+
+    iib_ops.finish(0, output="index-1-output")
+    assert first.result().build_details.index_image == "index-1-output"
+    # the next operation is based on the output of the previous build
+    assert iib_ops.submitted[2][0].index_image == "index-1-output"
+    assert iib_ops.submitted[2][0].op_args["bundles"] == ["bundle2"]
+
+    iib_ops.finish(1)
+    iib_ops.finish(2)
+    assert other.done() and second.done()
+
+
+def test_overwrite_from_index_not_chained():
+    iib_ops = FakeIIBOperations()
+    scheduler = IndexScheduler(iib_ops)
+
+    scheduler.schedule(make_op("index-1", overwrite_from_index=True))
+    scheduler.schedule(make_op("index-1", overwrite_from_index=True))
+    iib_ops.finish(0, output="index-1-output")
+
+    assert [op.index_image for op, __ in iib_ops.submitted] == ["index-1", "index-1"]
+
+
+def test_max_concurrency():
+    iib_ops = FakeIIBOperations()
+    scheduler = IndexScheduler(iib_ops, max_concurrency=2)
+
+    for index in ("index-1", "index-2", "index-3", None, None):
+        scheduler.schedule(make_op(index))
+    assert len(iib_ops.submitted) == 2
+
+    iib_ops.finish(0)
+    iib_ops.finish(1)
+    assert [op.index_image for op, __ in iib_ops.submitted] == [
+        "index-1",
+        "index-2",
+        "index-3",
+        None,
+    ]
+
+
+def test_failed_build_not_chained():
+    iib_ops = FakeIIBOperations()
+    scheduler = IndexScheduler(iib_ops)
+
+    first = scheduler.schedule(make_op("index-1"))
+    scheduler.schedule(make_op("index-1"))
+    iib_ops.finish(0, output="broken-output", failed=True)
+
+    assert isinstance(first.exception(), IIBBuildFailed)
+    assert iib_ops.submitted[1][0].index_image == "index-1"
+
+
+def test_cancel():
+    iib_ops = FakeIIBOperations()
+    scheduler = IndexScheduler(iib_ops)
+
+    running = scheduler.schedule(make_op("index-1"))
+    queued = scheduler.schedule(make_op("index-1"))
+    after = scheduler.schedule(make_op("index-1"))
+
+    assert queued.cancel()
+    assert running.cancel()
+    # cancelling the running operation cancels its build
+    assert iib_ops.submitted[0][1].cancelled()
+    assert [f.cancelled() for __, f in iib_ops.submitted] == [True, False]
+    iib_ops.finish(1)
+    assert not after.cancelled() and after.done()
+
+
+def test_invalid_concurrency():
+    with pytest.raises(ValueError):
+        IndexScheduler(FakeIIBOperations(), max_concurrency=0)
@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+import pytest
+
+# modules which must be imported only once an IIB operation actually runs
+HEAVY_MODULES = ("requests", "iiblib", "pushcollector", "kerberos", "pkg_resources")
+
+# generous limit for cumulative import time of the CLI module in microseconds,
+# usual value is a few tens of milliseconds
+STARTUP_BUDGET_US = 500000
+
+
+def import_times(code):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    ret = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        ret[name.strip()] = int(cumulative)
+    return ret
+
+
+@pytest.mark.parametrize(
+    "parser",
+    [
+        "make_add_bundles_parser",
+        "make_rm_operators_parser",
+        "make_add_deprecations_parser",
+    ],
+)
+def test_cli_startup(parser):
+    times = import_times(
+        "import pubtools.iib.iib_ops as ops; ops.%s().format_help()" % parser
+    )
+
+    heavy = [name for name in times if name.split(".")[0] in HEAVY_MODULES]
+    assert heavy == []
+    assert times["pubtools.iib.iib_ops"] < STARTUP_BUDGET_US
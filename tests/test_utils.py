@@ -0,0 +1,107 @@
+import mock
+import pytest
+
+from pubtools.iib.session import RateLimiter, TokenBucket, get_http_adapter
+from pubtools.iib.utils import setup_iib_client
+from pubtools.iib.iib_ops import make_add_bundles_parser
+
+
+def test_get_http_adapter_shared():
+    adapter = get_http_adapter(pool_size=4, timeout=10, retries=1)
+
+    assert get_http_adapter(pool_size=4, timeout=10, retries=1) is adapter
+    assert get_http_adapter(pool_size=5, timeout=10, retries=1) is not adapter
+    assert adapter.timeout == 10
+    assert adapter.max_retries.total == 1
+
+
+def test_http_adapter_default_timeout():
+    adapter = get_http_adapter(pool_size=4, timeout=10, retries=1)
+    with mock.patch("requests.adapters.HTTPAdapter.send") as send:
+        adapter.send("request")
+        adapter.send("request", timeout=5)
+
+    assert send.call_args_list == [
+        mock.call("request", timeout=10),
+        mock.call("request", timeout=5),
+    ]
+
+
+@mock.patch("pubtools.iib.auth.CachedKrbAuth.get")
+@mock.patch("iiblib.iib_client.IIBClient")
+def test_setup_iib_client_shared_pool(iib_client, iib_krb_auth):
+    args = make_add_bundles_parser().parse_args(
+        [
+            "--iib-server",
+            "iib-server",
+            "--iib-krb-principal",
+            "example@REALM",
+            "--iib-pool-size",
+            "20",
+        ]
+    )
+
+    setup_iib_client(args)
+    setup_iib_client(args)
+
+    adapter = get_http_adapter(pool_size=20, timeout=30, retries=3)
+    session = iib_client.return_value.iib_session.session
+    assert (
+        session.mount.call_args_list
+        == [
+            mock.call("https://", adapter),
+            mock.call("http://", adapter),
+        ]
+        * 2
+    )
+
+
+def test_token_bucket_rate():
+    clock = [100.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    with mock.patch("time.monotonic", side_effect=lambda: clock[0]), mock.patch(
+        "time.sleep", side_effect=sleep
+    ):
+        bucket = TokenBucket(rate=10, burst=2)
+        waited = [bucket.acquire() for _ in range(4)]
+
+    # burst of two, then one token every 0.1s
+    assert waited == [0, 0, pytest.approx(0.1), pytest.approx(0.1)]
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=0)
+    assert bucket.acquire() == 0
+
+    bucket.pause(0.05)
+    assert bucket.acquire() >= 0.04
+
+
+def test_rate_limiter_buckets():
+    limiter = RateLimiter(submit_rate=1, poll_rate=100)
+    limiter.submit.acquire = mock.Mock(return_value=0)
+    limiter.poll.acquire = mock.Mock(return_value=0)
+
+    limiter.acquire("POST")
+    limiter.acquire("GET")
+    limiter.acquire("GET")
+
+    assert limiter.submit.acquire.call_count == 1
+    assert limiter.poll.acquire.call_count == 2
+
+
+def test_http_adapter_retry_after():
+    adapter = get_http_adapter(pool_size=4, timeout=10, retries=1, poll_rate=5)
+    response = mock.Mock(status_code=429, headers={"Retry-After": "7"})
+    request = mock.Mock(method="GET")
+
+    with mock.patch("requests.adapters.HTTPAdapter.send", return_value=response):
+        with mock.patch.object(adapter.rate_limiter, "pause") as pause:
+            assert adapter.send(request) is response
+
+    pause.assert_called_once_with(7)
+    assert adapter.max_retries.rate_limiter is adapter.rate_limiter
+    assert adapter.max_retries.new().rate_limiter is adapter.rate_limiter
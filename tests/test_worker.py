@@ -0,0 +1,160 @@
+import threading
+
+import mock
+import pytest
+
+from pubtools.iib.iib_ops import ADD_CMD_ARGS
+from pubtools.iib.worker import (
+    IIBWorker,
+    WorkerError,
+    make_namespace,
+    submit_to_worker,
+)
+
+
+def test_make_namespace():
+    args = make_namespace(
+        ADD_CMD_ARGS,
+        {
+            "--iib-server": "iib-server",
+            "iib_krb_principal": "example@REALM",
+            "index_image": ["index-image"],
+            "bundle": ["bundle1"],
+        },
+    )
+
+    assert args.iib_server == "iib-server"
+    assert args.iib_krb_principal == "example@REALM"
+    assert args.index_image == ["index-image"]
+    assert args.bundle == ["bundle1"]
+    assert args.iib_pool_size == 10
+    assert args.binary_image is None
+
+
+def test_make_namespace_missing_required():
+    with pytest.raises(WorkerError, match="--iib-server"):
+        make_namespace(ADD_CMD_ARGS, {"iib_krb_principal": "example@REALM"})
+
+
+@pytest.fixture
+def worker(tmp_path):
+    worker = IIBWorker(str(tmp_path / "worker.sock"))
+    thread = threading.Thread(target=worker.serve_forever)
+    thread.start()
+    yield worker
+    worker.shutdown()
+    thread.join()
+    worker.server_close()
+
+
+def test_worker_roundtrip(worker):
+    def run_operations(args, operation, items_final_state, collector):
+        assert args.iib_server == "iib-server"
+        assert args.worker_socket is None
+        assert operation == "remove_operators"
+        assert items_final_state == "DELETED"
+        collector.update_push_items([{"state": "PENDING"}])
+        collector.update_push_items([{"state": "DELETED"}])
+        result = mock.MagicMock(failed=False)
+        result.build_details.to_dict.return_value = {"id": 1}
+        return [result]
+
+    with mock.patch("pubtools.iib.worker._run_operations", side_effect=run_operations):
+        response = submit_to_worker(
+            worker.socket_path,
+            "remove_operators",
+            {
+                "iib_server": "iib-server",
+                "iib_krb_principal": "example@REALM",
+                "operator": ["operator-1"],
+                "worker_socket": "/other/socket",
+            },
+        )
+
+    assert response == {
+        "ok": True,
+        "failed": False,
+        "builds": [{"id": 1}],
+        "push_items": [{"state": "PENDING"}, {"state": "DELETED"}],
+    }
+
+
+def test_worker_error(worker):
+    with pytest.raises(WorkerError, match="Unsupported iib operation"):
+        submit_to_worker(worker.socket_path, "invalid-op", {})
+
+    with mock.patch(
+        "pubtools.iib.worker._run_operations", side_effect=RuntimeError("boom")
+    ):
+        with pytest.raises(WorkerError, match="RuntimeError: boom"):
+            submit_to_worker(
+                worker.socket_path,
+                "add_bundles",
+                {"iib_server": "iib-server", "iib_krb_principal": "example@REALM"},
+            )
+
+
+def test_worker_coalesce(tmp_path):
+    worker = IIBWorker(str(tmp_path / "worker.sock"), coalesce_window=0.5)
+    thread = threading.Thread(target=worker.serve_forever)
+    thread.start()
+    calls = []
+
+    def run_operations(args, operation, items_final_state, collector):
+        calls.append(args)
+        collector.update_push_items(
+            [{"state": "PUSHED", "src": bundle} for bundle in args.bundle]
+        )
+        result = mock.MagicMock(failed=False)
+        result.build_details.to_dict.return_value = {"id": 1}
+        return [result]
+
+    responses = {}
+
+    def submit(bundle, deprecation_list):
+        responses[bundle] = submit_to_worker(
+            worker.socket_path,
+            "add_bundles",
+            {
+                "iib_server": "iib-server",
+                "iib_krb_principal": "example@REALM",
+                "index_image": ["index-image"],
+                "bundle": [bundle],
+                "deprecation_list": deprecation_list,
+            },
+        )
+
+    try:
+        with mock.patch(
+            "pubtools.iib.worker._run_operations", side_effect=run_operations
+        ):
+            clients = [
+                threading.Thread(target=submit, args=("bundle1", "old1")),
+                threading.Thread(target=submit, args=("bundle2", None)),
+            ]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+    finally:
+        worker.shutdown()
+        thread.join()
+        worker.server_close()
+
+    assert len(calls) == 1
+    assert sorted(calls[0].bundle) == ["bundle1", "bundle2"]
+    assert calls[0].deprecation_list == "old1"
+    assert responses["bundle1"]["push_items"] == [{"state": "PUSHED", "src": "bundle1"}]
+    assert responses["bundle2"]["push_items"] == [{"state": "PUSHED", "src": "bundle2"}]
+    assert responses["bundle1"]["builds"] == [{"id": 1}]
+
+
+def test_worker_removes_socket(tmp_path):
+    socket_path = tmp_path / "worker.sock"
+    socket_path.write_text("stale")
+
+    worker = IIBWorker(str(socket_path))
+    assert oct(socket_path.stat().st_mode & 0o777) == "0o700"
+    worker.server_close()
+
+    assert not socket_path.exists()
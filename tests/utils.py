@@ -18,7 +18,7 @@ class FakeTaskManager(object):
         binary_image="binary-image",
         overwrite_from_index=False,
         overwrite_from_index_token=None,
-        state_seq=("in_progress", "finished"),
+        state_seq=("in_progress", "complete"),
         op_type="add",
         build_tags=None,
         deprecation_list=None,
@@ -44,7 +44,7 @@ class FakeTaskManager(object):
             "internal_index_image_copy": "feed.com/index/image:tag",
             "internal_index_image_copy_resolved": "fake-example.com/index/image-resolved:tag",
             "arches": arches,
-            "batch": 123,
+            "batch": 123 + self.task_id,
             "updated": "2020-05-26T19:33:58.759687Z",
             "user": "tbrady@DOMAIN.LOCAL",
             "removed_operators": [k for k in operators],